@@ -0,0 +1,20 @@
+from math import gcd
+
+import numpy as np
+from scipy.signal import resample_poly
+
+WHISPER_SAMPLE_RATE = 16000
+
+
+def to_whisper_audio(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Downmixes captured audio to mono and resamples it to Whisper's 16 kHz."""
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        divisor = gcd(WHISPER_SAMPLE_RATE, sample_rate)
+        audio = resample_poly(
+            audio, WHISPER_SAMPLE_RATE // divisor, sample_rate // divisor
+        )
+
+    return np.ascontiguousarray(audio, dtype=np.float32)
@@ -1,42 +1,538 @@
+import itertools
 import os
+import queue
 import subprocess
+import threading
+import time
+import uuid
+
+from rich import print
 
-# from rich import print
 # from rich.progress import Progress
 # from rich.console import Console
 # from rich.text import Text
 import numpy as np
+import requests
 import sounddevice as sd
-from scipy.io import wavfile
 from datetime import datetime
 
 from pynput.keyboard import Controller as KeyboardController, Key, Listener
 
-from app.keyboard import keyboard_controller
+from app.audio import to_whisper_audio
+from app.keyboard import keyboard_controller, keyboard_lock
 from app.macros import MACROS
+from app.selection import copy_selection, read_primary_selection
+from app.tracing import new_request_id, now_us, tracer
+from app.transport import negotiate_transport
+
+MIN_SAMPLES_FOR_TRANSCRIBE = 8000
+
+# What a new push-to-talk press does to jobs that are still in flight:
+#   queue   - let them finish; the new dictation runs behind them
+#   preempt - cancel them; the new dictation takes over
+JOB_POLICIES = ["queue", "preempt"]
+
+
+class Job:
+    """
+    A single dictation moving through the processing pipeline.
+
+    Audio blocks are appended by the input stream callback while the
+    push-to-talk keys are held, then each stage fills in its own fields.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, sample_rate: int):
+        self.id = next(Job._ids)
+        # Travels with the job to the server so its spans can be correlated
+        self.request_id = new_request_id()
+        self.created_at = now_us()
+        self.enqueued_at = None
+        # Seconds spent in each stage, by stage name
+        self.timings = {}
+        self.sample_rate = sample_rate
+        self.audio_blocks = []
+        self.clipboard_contents = ""
+        self.audio = None
+        self.language = None
+        self.transcript = None
+        self.text = None
+        self.generated = False
+        self.cancel_event = threading.Event()
+        # Set once the push-to-talk keys are released
+        self.captured = threading.Event()
+        # Set once clipboard_contents is filled in (immediately if unused)
+        self.context_ready = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class Pipeline:
+    """
+    Runs jobs through a list of named stages, each on its own worker thread.
+
+    A stage is a callable taking the job and returning True to hand it to the
+    next stage, or False to drop it. Jobs flow through every stage in the
+    order they were submitted, so consecutive dictations overlap (one can be
+    transcribing while the previous one is still being typed) without ever
+    being injected out of order.
+    """
+
+    def __init__(
+        self,
+        stages,
+        policy: str = "queue",
+        on_stage: callable = None,
+        on_finish: callable = None,
+    ):
+        if policy not in JOB_POLICIES:
+            raise ValueError(f"Unknown job policy: {policy}")
+
+        self.policy = policy
+        self.stages = stages
+        # Called from the worker thread as on_stage(name, job) after each
+        # stage that completes successfully
+        self.on_stage = on_stage or (lambda name, job: None)
+        # Called as on_finish(job) when a job leaves the pipeline for any
+        # reason: typed, dropped, failed or cancelled
+        self.on_finish = on_finish or (lambda job: None)
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queues = [queue.Queue() for _ in stages]
+        self._workers = []
+
+        for index, (name, _) in enumerate(stages):
+            worker = threading.Thread(
+                target=self._run_stage,
+                args=(index,),
+                name=f"vibrance-{name}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def new_job(self, sample_rate: int) -> Job:
+        """
+        Creates a job for a new dictation, applying the preemption policy to
+        anything still in flight.
+        """
+        if self.policy == "preempt":
+            self.cancel()
+
+        job = Job(sample_rate)
+
+        with self._lock:
+            self._jobs[job.id] = job
+
+        return job
+
+    def submit(self, job: Job):
+        """Hands a captured job to the first stage."""
+        job.captured.set()
+        job.enqueued_at = now_us()
+        tracer.record("capture", job.created_at, job.enqueued_at, job.request_id, job=job.id)
+        job.timings["capture"] = (job.enqueued_at - job.created_at) / 1e6
+        self._queues[0].put(job)
+
+    def discard(self, job: Job):
+        """Drops a job that was started but will never be submitted."""
+        job.cancel()
+        job.captured.set()
+        self._finish(job)
+
+    def cancel(self, job_id: int = None) -> int:
+        """
+        Cancels one job, or every in-flight job if no ID is given.
+
+        Returns:
+            int: The number of jobs that were cancelled.
+        """
+        with self._lock:
+            if job_id is None:
+                jobs = list(self._jobs.values())
+            else:
+                jobs = [self._jobs[job_id]] if job_id in self._jobs else []
+
+        for job in jobs:
+            job.cancel()
+
+        return len(jobs)
+
+    def active_jobs(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stop(self, timeout: float = None):
+        """Cancels in-flight jobs and shuts the stage workers down."""
+        self.cancel()
+        self._queues[0].put(None)
+
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _finish(self, job: Job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+        try:
+            self.on_finish(job)
+        except Exception as e:
+            print(f"[red]Error finishing job {job.id}:[/red] {e}")
+
+    def _run_stage(self, index: int):
+        name, stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+
+        while True:
+            job = inbox.get()
+
+            if job is None:
+                # Shutdown sentinel; pass it down the line
+                if outbox is not None:
+                    outbox.put(None)
+                return
+
+            tracer.record(f"queue.{name}", job.enqueued_at, now_us(), job.request_id, job=job.id)
+
+            if job.cancelled:
+                print(f"[yellow]>>> (Job {job.id} cancelled.)[/yellow]")
+                self._finish(job)
+                continue
+
+            try:
+                started = time.perf_counter()
+                with tracer.request(job.request_id), tracer.span(f"stage.{name}", job=job.id):
+                    keep = stage(job)
+                job.timings[name] = time.perf_counter() - started
+            except Exception as e:
+                print(f"[red]Error in {name} stage (job {job.id}):[/red] {e}")
+                keep = False
+
+            if keep and not job.cancelled:
+                self.on_stage(name, job)
+
+            if keep and not job.cancelled and outbox is not None:
+                job.enqueued_at = now_us()
+                outbox.put(job)
+            else:
+                self._finish(job)
 
 
 class VibranceCore:
     server_process = None
+    transport = None
 
-    def __init__(self, input_device=None):
+    def __init__(
+        self,
+        input_device=None,
+        server_host="http://localhost:4242",
+        mode="default",
+        typing_delay=0.01,
+        add_space=True,
+        language="auto",
+        copy_selection=False,
+        start_progress: callable = None,
+        stop_progress: callable = None,
+    ):
         self.input_device = input_device
+        self.server_host = server_host
+        self.mode = mode
+        self.typing_delay = typing_delay
+        self.add_space = add_space
+        self.language = language
+        self.copy_selection = copy_selection
+        # Lets the server cache the detected language for this client
+        self.session_id = uuid.uuid4().hex
+        # start_progress returns a handle for stop_progress, since stages of
+        # different jobs can show progress at the same time
+        self.start_progress = start_progress or (lambda label: None)
+        self.stop_progress = stop_progress or (lambda task=None: None)
 
-    def start_server(self, cpu=False, model=None):
+    def start_server(self, cpu=False, model=None, autotune=False, chunk_workers=1):
         server_script = os.path.join(os.path.dirname(__file__), "server/server.py")
         command = ["python", server_script]
         if cpu:
             command.append("--cpu")
+        if autotune:
+            command.append("--autotune")
+        if chunk_workers > 1:
+            command.append(f"--chunk-workers={chunk_workers}")
         command.append("--model=" + (model if model else "small"))
         process = subprocess.Popen(command)
 
         self.server_process = process
 
+    def wait_for_server(self, timeout=1800, interval=0.5, stop_event=None):
+        """
+        Waits for a server to become available by periodically sending a health check request.
+
+        Args:
+            timeout (int, optional): The maximum time to wait for the server to start, in seconds. Defaults to 1800 seconds (30 minutes).
+            interval (float, optional): The time interval between consecutive health check requests, in seconds. Defaults to 0.5 seconds.
+            stop_event (threading.Event, optional): Gives up waiting when set.
+
+        Returns:
+            bool: True if the server becomes available, False if stop_event was set first.
+
+        Raises:
+            TimeoutError: If the server does not become available within the specified timeout period.
+        """
+        start_time = time.time()
+
+        while time.time() - start_time < timeout:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            try:
+                response = requests.get(f"{self.server_host}/health", timeout=5)
+                if response.status_code == 200:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(interval)
+
+        raise TimeoutError("Server failed to start within timeout")
+
+    def connect(self, transport: str = "auto"):
+        """Negotiates how audio gets to the server; call once it is up."""
+        self.transport = negotiate_transport(
+            self.server_host,
+            transport,
+            headers={
+                "X-Vibrance-Session": self.session_id,
+                "X-Vibrance-Language": self.language,
+            },
+        )
+
+    def disconnect(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
     def stop_server(self):
         if self.server_process:
             self.server_process.terminate()
             self.server_process.wait()  # Ensure the process is fully terminated
 
+    def build_pipeline(
+        self, policy: str = "queue", on_stage: callable = None, on_finish: callable = None
+    ) -> Pipeline:
+        """
+        Builds the capture -> encode -> transcribe -> post-process -> inject
+        pipeline. Capture happens in the input stream callback, which fills
+        the job's audio blocks; the remaining stages run on worker threads.
+        """
+        return Pipeline(
+            [
+                ("encode", self.encode_job),
+                ("transcribe", self.transcribe_job),
+                ("process", self.process_job),
+                ("inject", self.inject_job),
+            ],
+            policy=policy,
+            on_stage=on_stage,
+            on_finish=on_finish,
+        )
+
+    def prepare_context(self, job: Job):
+        """
+        Called as recording starts. In the LLM modes, grabs the selection (if
+        --copy-selection is on) and has Ollama load the model and prefill the
+        prompt prefix on a background thread, so that by the time the
+        transcript arrives only the spoken query is left to process.
+        """
+        if self.mode not in ["code", "llm"]:
+            job.context_ready.set()
+            return
+
+        threading.Thread(
+            target=self._prepare_context, args=(job,), name="vibrance-context", daemon=True
+        ).start()
+
+    def _prepare_context(self, job: Job):
+        with tracer.request(job.request_id):
+            self._capture_and_prewarm(job)
+
+    def _capture_and_prewarm(self, job: Job):
+        try:
+            if self.copy_selection:
+                with tracer.span("selection.primary"):
+                    contents = read_primary_selection()
+
+                if contents is None:
+                    # No way to read PRIMARY; fall back to Ctrl+C, which has
+                    # to wait until the push-to-talk keys are let go
+                    job.captured.wait()
+                    with tracer.span("selection.copy"):
+                        contents = copy_selection()
+
+                job.clipboard_contents = contents.strip()
+                print(f"[yellow]Selection contents: {job.clipboard_contents}[/yellow]")
+        finally:
+            job.context_ready.set()
+
+        if self.mode == "code":
+            from app.mode.code import prewarm
+        else:
+            from app.mode.llm import prewarm
+
+        try:
+            prewarm(job.clipboard_contents)
+        except Exception as e:
+            print(f"[red]Error prewarming LLM:[/red] {e}")
+
+    def encode_job(self, job: Job) -> bool:
+        """Concatenates the captured blocks into 16 kHz mono float32 PCM."""
+        try:
+            audio_data_np = np.concatenate(job.audio_blocks, axis=0)
+        except ValueError as e:
+            print(e)
+            return False
+
+        if audio_data_np.shape[0] < MIN_SAMPLES_FOR_TRANSCRIBE:
+            # Ensure there's enough data for Whisper to process
+            print("[yellow]>>> (Ignoring short response.)[/yellow]", end="")
+            return False
+
+        job.audio = to_whisper_audio(audio_data_np, job.sample_rate)
+        job.audio_blocks = []
+
+        return True
+
+    def transcribe_job(self, job: Job) -> bool:
+        """Sends the job's audio to the transcription server."""
+        task = self.start_progress("[yellow bold]Transcribing...[/bold yellow]")
+        try:
+            result = self.transport.transcribe(job.audio, request_id=job.request_id)
+            tracer.write(result.pop("trace", []))
+            transcript = result["text"]
+            job.language = result.get("language")
+        except requests.exceptions.RequestException as e:
+            print(f"[red]Error sending request to local API:[/red] {e}")
+            return False
+        finally:
+            self.stop_progress(task)
+
+        if not transcript:
+            return False
+
+        if self.add_space:
+            transcript += " "
+
+        print(
+            f'[yellow bold]>>>[/bold yellow] [white bold]"{transcript}"[/bold white] [dim]({job.language})[/dim]'
+        )
+
+        job.transcript = transcript
+
+        return True
+
+    def process_job(self, job: Job) -> bool:
+        """
+        Processes the transcript, applying transformations or executing macros
+        based on predefined rules.
+
+        Behavior:
+            - If mode is "default":
+                - Converts the input text to lowercase and removes non-alphanumeric characters.
+                - Checks if the processed text matches any key in the MACROS dictionary.
+                - If a match is found:
+                    - If the corresponding value is callable, executes the function and clears the text.
+                    - Otherwise, replaces the text with the corresponding value from the MACROS dictionary.
+            - Mode "raw": Simply types the dictated text without any processing.
+            - Mode "llm": Calls Ollama to generate a response based on the input text.
+            - Mode "code" Calls Ollama with a specialized prompt and structured response to help ensure we're getting code back.
+        """
+        dictated_text = job.transcript
+
+        if self.mode == "default":
+            sluggified = "".join(
+                char for char in dictated_text.lower() if char.isalnum()
+            )
+
+            for key, value in MACROS.items():
+                if sluggified == key:
+
+                    if callable(value):
+                        # If the value is a callable function, execute it
+                        # This allows for special keys like 'up', 'down', etc.
+                        print(f"Matched '{key}' in '{sluggified}' -> Executing function")
+                        value()
+
+                        dictated_text = ""
+                    else:
+                        print(
+                            f"Matched '{key}' in '{sluggified}' -> Replacing with '{value}'"
+                        )
+                        # Replace the matched key with its corresponding value
+                        dictated_text = value
+                        break
+        elif self.mode in ["code", "llm"]:
+
+            job.context_ready.wait()
+
+            task = self.start_progress("[purple bold]Inferring...[/purple bold]")
+
+            try:
+                if self.mode == "code":
+                    from app.mode.code import fetch_code
+
+                    dictated_text = fetch_code(
+                        dictated_text, job.clipboard_contents, job.cancel_event
+                    )
+
+                elif self.mode == "llm":
+                    from app.mode.llm import fetch_response
+
+                    dictated_text = fetch_response(
+                        dictated_text, job.clipboard_contents, job.cancel_event
+                    )
+            finally:
+                self.stop_progress(task)
+
+            if job.cancelled:
+                return False
+
+            dictated_text = dictated_text.strip() + "\n"
+            job.generated = True
+
+            print(f"[yellow bold]>>> Generated response:[/yellow bold]\n{dictated_text}")
+
+        job.text = dictated_text
+
+        return bool(dictated_text)
+
+    def inject_job(self, job: Job) -> bool:
+        """Types the processed text, stopping early if the job is cancelled."""
+        with keyboard_lock:
+            for char in job.text:
+                if job.cancelled:
+                    print(f"[yellow]>>> (Job {job.id} cancelled while typing.)[/yellow]")
+                    break
+
+                if job.generated and char == "\n":
+                    # for some reason we need to slow down when hitting ENTER or
+                    # they get skipped sometimes
+                    keyboard_controller.press(Key.enter)
+                    time.sleep(0.2)
+                    keyboard_controller.release(Key.enter)
+                    time.sleep(0.2)
+                elif job.generated and char == "\t":
+                    keyboard_controller.type("    ")
+                else:
+                    keyboard_controller.press(char)
+                    time.sleep(self.typing_delay)
+                    keyboard_controller.release(char)
+
+        return True
+
 
 def list_input_devices():
     """Lists all available input devices."""
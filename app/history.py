@@ -0,0 +1,262 @@
+"""Append-only store of past dictations: compressed audio plus a searchable index"""
+
+import gzip
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from rich import print
+from scipy.io import wavfile
+
+from app.audio import WHISPER_SAMPLE_RATE
+
+HISTORY_DIR = os.path.join(os.path.expanduser("~"), ".local", "share", "vibrance", "history")
+
+# Retention limits, enforced by the writer every PRUNE_EVERY entries
+HISTORY_DAYS = 180
+HISTORY_MAX_MB = 1024
+PRUNE_EVERY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    request_id TEXT,
+    mode TEXT,
+    model TEXT,
+    language TEXT,
+    transcript TEXT,
+    output TEXT,
+    duration REAL,
+    audio_path TEXT,
+    audio_bytes INTEGER,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+"""
+
+# Full-text index over what was said and what was typed, kept in sync with
+# the entries table by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (
+    transcript, output, content='entries', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, transcript, output)
+    VALUES (new.id, new.transcript, new.output);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, transcript, output)
+    VALUES ('delete', old.id, old.transcript, old.output);
+END;
+"""
+
+
+def connect(directory: str = HISTORY_DIR) -> sqlite3.Connection:
+    os.makedirs(directory, exist_ok=True)
+
+    db = sqlite3.connect(os.path.join(directory, "history.db"), check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+
+    try:
+        db.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        pass  # SQLite built without FTS5; search() falls back to LIKE
+
+    return db
+
+
+def has_fts(db: sqlite3.Connection) -> bool:
+    return (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'"
+        ).fetchone()
+        is not None
+    )
+
+
+def write_audio(path: str, audio: np.ndarray) -> int:
+    """Writes 16 kHz float PCM as a gzipped 16-bit WAV; returns its size."""
+    pcm = (np.clip(audio, -1.0, 1.0) * np.iinfo(np.int16).max).astype(np.int16)
+
+    buffer = io.BytesIO()
+    wavfile.write(buffer, WHISPER_SAMPLE_RATE, pcm)
+
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        f.write(buffer.getvalue())
+
+    return os.path.getsize(path)
+
+
+def read_audio(path: str) -> np.ndarray:
+    """Reads a stored clip back as 16 kHz float32 PCM."""
+    with gzip.open(path, "rb") as f:
+        _, pcm = wavfile.read(io.BytesIO(f.read()))
+
+    return pcm.astype(np.float32) / np.iinfo(np.int16).max
+
+
+def fts_query(query: str) -> str:
+    """
+    Quotes each word of a plain-text query, so that punctuation such as
+    "docker-compose" or "what's" is matched literally instead of being parsed
+    as FTS5 syntax. Entries must contain every word.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+def search(db: sqlite3.Connection, query: str = None, limit: int = 20) -> list:
+    """Newest entries first, optionally only those containing every word of query."""
+    if not query or not query.split():
+        return db.execute(
+            "SELECT * FROM entries ORDER BY created DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    if has_fts(db):
+        return db.execute(
+            "SELECT entries.* FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid "
+            "WHERE entries_fts MATCH ? ORDER BY entries.created DESC LIMIT ?",
+            (fts_query(query), limit),
+        ).fetchall()
+
+    pattern = f"%{query}%"
+    return db.execute(
+        "SELECT * FROM entries WHERE transcript LIKE ? OR output LIKE ? "
+        "ORDER BY created DESC LIMIT ?",
+        (pattern, pattern, limit),
+    ).fetchall()
+
+
+def get(db: sqlite3.Connection, entry_id: int):
+    return db.execute("SELECT * FROM entries WHERE id = ?", (entry_id,)).fetchone()
+
+
+class HistoryWriter(threading.Thread):
+    """
+    Records finished jobs off the hot path. record() only snapshots the
+    job onto a queue; compression, file writes, inserts and pruning all
+    happen on this thread.
+    """
+
+    def __init__(
+        self,
+        directory: str = HISTORY_DIR,
+        model: str = None,
+        max_days: float = HISTORY_DAYS,
+        max_mb: float = HISTORY_MAX_MB,
+    ):
+        super().__init__(name="vibrance-history", daemon=True)
+        self.directory = directory
+        self.model = model
+        self.max_days = max_days
+        self.max_mb = max_mb
+
+        self._entries = queue.Queue()
+        self._written = 0
+
+    def record(self, job, mode: str):
+        """Queues a finished job; jobs that never produced a transcript are skipped."""
+        if not job.transcript or job.audio is None:
+            return
+
+        self._entries.put(
+            {
+                "created": job.created_at / 1e6,
+                "request_id": job.request_id,
+                "mode": mode,
+                "model": self.model,
+                "language": job.language,
+                "transcript": job.transcript.strip(),
+                "output": (job.text or "").strip(),
+                "audio": job.audio,
+                "timings": dict(job.timings),
+            }
+        )
+
+    def stop(self):
+        self._entries.put(None)
+
+    def run(self):
+        db = connect(self.directory)
+
+        while True:
+            entry = self._entries.get()
+            if entry is None:
+                break
+
+            try:
+                self._write(db, entry)
+            except (OSError, sqlite3.Error) as e:
+                print(f"[red]Error writing history:[/red] {e}")
+
+        db.close()
+
+    def _write(self, db: sqlite3.Connection, entry: dict):
+        day = datetime.fromtimestamp(entry["created"]).strftime("%Y-%m-%d")
+        audio_dir = os.path.join(self.directory, "audio", day)
+        os.makedirs(audio_dir, exist_ok=True)
+
+        audio = entry.pop("audio")
+        audio_path = os.path.join(audio_dir, f"{entry['request_id']}.wav.gz")
+        audio_bytes = write_audio(audio_path, audio)
+
+        with db:
+            db.execute(
+                "INSERT INTO entries (created, request_id, mode, model, language, transcript, "
+                "output, duration, audio_path, audio_bytes, timings) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entry["created"],
+                    entry["request_id"],
+                    entry["mode"],
+                    entry["model"],
+                    entry["language"],
+                    entry["transcript"],
+                    entry["output"],
+                    audio.shape[0] / WHISPER_SAMPLE_RATE,
+                    os.path.relpath(audio_path, self.directory),
+                    audio_bytes,
+                    json.dumps(entry["timings"]),
+                ),
+            )
+
+        self._written += 1
+        if self._written % PRUNE_EVERY == 1:
+            self.prune(db)
+
+    def prune(self, db: sqlite3.Connection):
+        """Deletes the oldest entries beyond the age and size limits."""
+        expired = db.execute(
+            "SELECT id, audio_path FROM entries WHERE created < ?",
+            (time.time() - self.max_days * 86400,),
+        ).fetchall()
+
+        total = db.execute("SELECT COALESCE(SUM(audio_bytes), 0) FROM entries").fetchone()[0]
+        excess = total - self.max_mb * 1024 * 1024
+        if excess > 0:
+            expired_ids = {row["id"] for row in expired}
+            for row in db.execute(
+                "SELECT id, audio_path, audio_bytes FROM entries ORDER BY created"
+            ):
+                if excess <= 0:
+                    break
+                if row["id"] not in expired_ids:
+                    expired.append(row)
+                excess -= row["audio_bytes"] or 0
+
+        for row in expired:
+            try:
+                os.remove(os.path.join(self.directory, row["audio_path"]))
+            except OSError:
+                pass
+
+        with db:
+            db.executemany("DELETE FROM entries WHERE id = ?", [(row["id"],) for row in expired])
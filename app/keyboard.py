@@ -1,3 +1,10 @@
+import threading
+
 from pynput.keyboard import Controller as KeyboardController, Key, Listener
 
-keyboard_controller = KeyboardController()
\ No newline at end of file
+keyboard_controller = KeyboardController()
+
+# Held while typing a job's text or sending a shortcut, so that keystrokes
+# from different threads (an earlier job still being typed, a Ctrl+C for the
+# next one's selection) never interleave into accidental shortcuts
+keyboard_lock = threading.Lock()
@@ -1,8 +1,7 @@
-from ollama import chat
-from ollama import ChatResponse
-
 from pydantic import BaseModel
 
+from app.mode.session import ChatSession
+
 
 class CodeRequest(BaseModel):
     code: str
@@ -20,8 +19,23 @@ SPROMPT = """
     and performance.
 """.strip()
 
+session = ChatSession(
+    MODEL,
+    TEMP,
+    system_prompt=SPROMPT,
+    format=CodeRequest.model_json_schema(),
+)
+
+
+def prewarm(clipboard_contents=None):
+    """
+    Loads the model and prefills the conversation so far plus the clipboard
+    context while the user is still talking.
+    """
+    session.prewarm(clipboard_contents)
 
-def fetch_code(query: str, clipboard_contents=None) -> str:
+
+def fetch_code(query: str, clipboard_contents=None, cancel_event=None) -> str:
     global last_query
 
     if query.lower().startswith("retry") and last_query:
@@ -32,25 +46,12 @@ def fetch_code(query: str, clipboard_contents=None) -> str:
     if clipboard_contents:
         print(f"[blue]==== Clipboard:[/blue]\n{clipboard_contents}")
 
-    response: ChatResponse = chat(
-        model=MODEL,
-        messages=[
-            {
-                "role": "system",
-                "content": SPROMPT,
-            },
-            {
-                "role": "user",
-                "content": query + (f"\n\n```\n{clipboard_contents}```" or ""),
-            },
-        ],
-        format=CodeRequest.model_json_schema(),
-        options={
-            "temperature": TEMP,
-        },
-    )
-
-    response = CodeRequest.model_validate_json(response.message.content)
+    content = session.ask(query, clipboard_contents, cancel_event)
+
+    if not content:
+        return ""
+
+    response = CodeRequest.model_validate_json(content)
 
     print(response)
 
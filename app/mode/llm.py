@@ -1,39 +1,24 @@
-from ollama import chat
-from ollama import ChatResponse
 from rich import print
 
+from app.mode.session import ChatSession
+
 
 MODEL = "llama3.1:latest"
 TEMP = 0.8
 
+session = ChatSession(MODEL, TEMP)
+
+
+def prewarm(clipboard_contents: str = ""):
+    """
+    Loads the model and prefills the conversation so far plus the clipboard
+    context while the user is still talking.
+    """
+    session.prewarm(clipboard_contents)
 
-def fetch_response(query: str, clipboard_contents:str = "") -> str:
+
+def fetch_response(query: str, clipboard_contents:str = "", cancel_event=None) -> str:
     if clipboard_contents:
         print(f"[blue]==== Clipboard:[/blue]\n{clipboard_contents}")
-        messages = [
-                {
-                    "role": "system",
-                    "content": query,
-                },
-                {
-                    "role": "user",
-                    "content": clipboard_contents,
-                },
-            ]
-    else:
-        messages = [
-            {
-                "role": "user",
-                "content": query,
-            },
-        ]
-
-    response: ChatResponse = chat(
-        model=MODEL,
-        messages=messages,
-        options={
-            "temperature": TEMP,
-        },
-    )
-
-    return response.message.content.strip()
\ No newline at end of file
+
+    return session.ask(query, clipboard_contents, cancel_event).strip()
@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+from ollama import chat
+from ollama import ChatResponse
+
+from app.tracing import tracer
+
+# Context window requested from Ollama, and how much of it the history may
+# use; the rest is left for the reply
+CONTEXT_TOKENS = 8192
+HISTORY_TOKENS = 6144
+
+RESPONSE_CACHE_SIZE = 32
+
+
+def estimate_tokens(message: dict) -> int:
+    """Rough token count; about four characters per token plus framing."""
+    return len(message["content"]) // 4 + 4
+
+
+class ChatSession:
+    """
+    A running conversation with one Ollama model.
+
+    Each turn's prompt is the previous prompt plus the reply and the new
+    messages, so Ollama can keep the earlier turns in its KV cache and only
+    prefill what was added. When the history outgrows HISTORY_TOKENS it is
+    cut back to half the budget in one go rather than a turn at a time,
+    since every trim changes the prefix and costs a full prefill.
+
+    Exact repeats of a query against the same context (e.g. "retry") are
+    answered from a small LRU cache.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        temperature: float,
+        system_prompt: str = None,
+        format: dict = None,
+        token_budget: int = HISTORY_TOKENS,
+        cache_size: int = RESPONSE_CACHE_SIZE,
+    ):
+        self.model = model
+        self.temperature = temperature
+        self.system_prompt = system_prompt
+        self.format = format
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+
+        self.history = []
+        self.context = None
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _options(self, **extra) -> dict:
+        return {"temperature": self.temperature, "num_ctx": CONTEXT_TOKENS, **extra}
+
+    def _system_messages(self) -> list:
+        if not self.system_prompt:
+            return []
+        return [{"role": "system", "content": self.system_prompt}]
+
+    def _context_message(self, context: str) -> dict:
+        return {"role": "user", "content": f"```\n{context}\n```"}
+
+    def _context_messages(self, context: str) -> list:
+        """The message introducing new clipboard context, if it changed."""
+        if not context or context == self.context:
+            return []
+        return [self._context_message(context)]
+
+    def _trim(self):
+        def total():
+            return sum(estimate_tokens(m) for m in self._system_messages() + self.history)
+
+        if total() <= self.token_budget:
+            return
+
+        # Drop whole turns from the front until we're at half the budget;
+        # a turn starts at a user message following an assistant reply
+        while self.history and total() > self.token_budget // 2:
+            self.history.pop(0)
+            while self.history and self.history[0]["role"] != "user":
+                self.history.pop(0)
+
+        # If the current context was trimmed away it has to be sent again
+        if self.context and self._context_message(self.context) not in self.history:
+            self.context = None
+
+    def prewarm(self, context: str = None):
+        """
+        Has Ollama load the model and prefill the conversation so far plus
+        any new context, ahead of the query.
+        """
+        with self._lock:
+            messages = (
+                self._system_messages()
+                + self.history
+                + self._context_messages(context)
+            )
+
+        with tracer.span("ollama.prewarm", model=self.model):
+            chat(
+                model=self.model,
+                messages=messages,
+                options=self._options(num_predict=1),
+            )
+
+    def ask(self, query: str, context: str = None, cancel_event=None) -> str:
+        """
+        Sends the query as the next turn and returns the reply, or "" if
+        cancelled part way through.
+        """
+        key = (context or "", query)
+
+        with self._lock:
+            new_messages = self._context_messages(context) + [
+                {"role": "user", "content": query}
+            ]
+            messages = self._system_messages() + self.history + new_messages
+            cached = self.cache.get(key)
+
+        if cached is not None:
+            content = cached
+        else:
+            stream = chat(
+                model=self.model,
+                messages=messages,
+                format=self.format,
+                options=self._options(),
+                stream=True,
+            )
+
+            content = ""
+            chunk: ChatResponse
+            with tracer.span("ollama.chat", model=self.model, turn=len(messages)):
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        # Dropping the stream closes the connection and stops generation
+                        return ""
+                    content += chunk.message.content
+
+        with self._lock:
+            self.history += new_messages + [{"role": "assistant", "content": content}]
+            if context:
+                self.context = context
+            self._trim()
+
+            self.cache[key] = content
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return content
@@ -0,0 +1,60 @@
+import shutil
+import subprocess
+import time
+
+from pynput.keyboard import Key
+from pyperclip import paste as clipboard_paste
+
+from app.keyboard import keyboard_controller, keyboard_lock
+
+# Tools that can print the PRIMARY selection (whatever text is highlighted)
+# without us having to send a copy shortcut to the focused window
+PRIMARY_SELECTION_COMMANDS = [
+    ["xclip", "-o", "-selection", "primary"],
+    ["xsel", "--primary", "--output"],
+    ["wl-paste", "--primary", "--no-newline"],
+]
+
+# How long to give the focused application to service a synthetic Ctrl+C
+COPY_SETTLE_SECONDS = 0.1
+
+
+def read_primary_selection():
+    """
+    Reads the PRIMARY selection directly.
+
+    Returns:
+        str | None: The selected text ("" if nothing is selected), or None if
+        no selection tool is available.
+    """
+    for command in PRIMARY_SELECTION_COMMANDS:
+        if shutil.which(command[0]) is None:
+            continue
+
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+
+        # These tools exit non-zero when there is simply no selection
+        return result.stdout if result.returncode == 0 else ""
+
+    return None
+
+
+def copy_selection() -> str:
+    """
+    Copies the selection by sending Ctrl+C to the focused window and reading
+    the clipboard back. Only safe once the push-to-talk keys are released,
+    otherwise the application sees Ctrl+Shift+C. Waits for any earlier job
+    that is still being typed.
+    """
+    with keyboard_lock:
+        keyboard_controller.press(Key.ctrl)
+        keyboard_controller.press("c")
+        keyboard_controller.release("c")
+        keyboard_controller.release(Key.ctrl)
+
+    time.sleep(COPY_SETTLE_SECONDS)
+
+    return clipboard_paste()
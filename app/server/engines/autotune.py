@@ -0,0 +1,203 @@
+"""Startup calibration of compute type and thread count for faster-whisper"""
+
+import gc
+import json
+import os
+import socket
+import time
+
+import ctranslate2
+from faster_whisper import WhisperModel, decode_audio
+
+PROFILE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "vibrance", "autotune.json"
+)
+
+# The demo video has a few seconds of clear speech, which is all we need
+CALIBRATION_AUDIO = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "docs", "demo.mp4"
+)
+CALIBRATION_SECONDS = 15
+CALIBRATION_RUNS = 2
+
+# Maximum word error rate against the reference transcript for a setting to
+# be considered; anything faster but less accurate than this is ignored
+ACCURACY_TOLERANCE = 0.05
+
+# Most precise type on each device; its transcript is the accuracy reference
+REFERENCE_COMPUTE_TYPES = {
+    "cpu": "float32",
+    "cuda": "float16",
+}
+
+CANDIDATE_COMPUTE_TYPES = {
+    "cpu": ["int8", "int8_float32", "float32"],
+    "cuda": ["float16", "int8_float16", "int8", "bfloat16", "int8_bfloat16"],
+}
+
+
+def profile_key(model: str, device: str) -> str:
+    return f"{model}|{device}|{socket.gethostname()}"
+
+
+def load_profiles() -> dict:
+    try:
+        with open(PROFILE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(model: str, device: str):
+    return load_profiles().get(profile_key(model, device))
+
+
+def save_profile(model: str, device: str, profile: dict):
+    profiles = load_profiles()
+    profiles[profile_key(model, device)] = profile
+
+    os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+
+    with open(PROFILE_PATH, "w") as f:
+        json.dump(profiles, f, indent=2)
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance between two transcripts, over the reference length."""
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (ref_word != hyp_word),
+                )
+            )
+        previous = current
+
+    return previous[-1] / len(ref)
+
+
+def thread_candidates(device: str) -> list:
+    if device == "cuda":
+        # Decoding happens on the GPU; CPU threads barely matter
+        return [0]
+
+    cores = os.cpu_count() or 1
+    return sorted({max(1, cores // 4), max(1, cores // 2), cores})
+
+
+def compute_type_candidates(device: str) -> list:
+    supported = ctranslate2.get_supported_compute_types(device)
+    return [t for t in CANDIDATE_COMPUTE_TYPES[device] if t in supported]
+
+
+def measure(model: str, device: str, compute_type: str, cpu_threads: int, audio):
+    """
+    Loads the model with the given settings and times transcription of the
+    calibration clip.
+
+    Returns:
+        tuple: Best wall time in seconds and the transcript.
+    """
+    whisper = WhisperModel(
+        model, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+    )
+
+    def run():
+        segments, _ = whisper.transcribe(audio)
+        return " ".join(segment.text.strip() for segment in segments)
+
+    run()  # warm-up
+
+    best = None
+    for _ in range(CALIBRATION_RUNS):
+        start = time.perf_counter()
+        text = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    del whisper
+    gc.collect()
+
+    return best, text
+
+
+def calibrate(model: str, device: str, audio_path: str = CALIBRATION_AUDIO) -> dict:
+    """
+    Tries every supported compute type and thread count for the model and
+    device, and picks the fastest whose transcript stays within
+    ACCURACY_TOLERANCE of the most precise setting.
+    """
+    audio = decode_audio(audio_path)[: CALIBRATION_SECONDS * 16000]
+
+    compute_types = compute_type_candidates(device)
+    reference_type = REFERENCE_COMPUTE_TYPES[device]
+    if reference_type not in compute_types:
+        reference_type = compute_types[-1]
+
+    threads = thread_candidates(device)
+
+    print(f"Autotune: calibrating {model} on {device}...")
+
+    _, reference = measure(model, device, reference_type, threads[-1], audio)
+
+    best = None
+    for compute_type in compute_types:
+        for cpu_threads in threads:
+            seconds, text = measure(model, device, compute_type, cpu_threads, audio)
+            wer = word_error_rate(reference, text)
+
+            print(
+                f"Autotune: {compute_type:>14} threads={cpu_threads:<3} "
+                f"{seconds:.3f}s wer={wer:.3f}"
+            )
+
+            if wer > ACCURACY_TOLERANCE:
+                continue
+
+            if best is None or seconds < best["seconds"]:
+                best = {
+                    "compute_type": compute_type,
+                    "cpu_threads": cpu_threads,
+                    "seconds": seconds,
+                    "wer": wer,
+                }
+
+    if best is None:
+        best = {
+            "compute_type": reference_type,
+            "cpu_threads": threads[-1],
+            "seconds": None,
+            "wer": 0.0,
+        }
+
+    return best
+
+
+def autotune(model: str, device: str, retune: bool = False, audio_path: str = CALIBRATION_AUDIO) -> dict:
+    """
+    Returns the tuned settings for this model, device and host, running the
+    calibration and caching the result on disk if there is no profile yet.
+    """
+    profile = None if retune else load_profile(model, device)
+
+    if profile is None:
+        profile = calibrate(model, device, audio_path)
+        save_profile(model, device, profile)
+        print(f"Autotune: saved profile to {PROFILE_PATH}")
+
+    print(
+        f"Autotune: using compute_type={profile['compute_type']} "
+        f"cpu_threads={profile['cpu_threads']}"
+    )
+
+    return profile
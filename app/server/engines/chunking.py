@@ -0,0 +1,92 @@
+"""Splitting long recordings into overlapping chunks and stitching them back"""
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Recordings longer than this are split and decoded in parallel, when the
+# engine has more than one chunk worker
+LONG_AUDIO_SECONDS = 60
+# Target chunk length; with the overlap added this stays inside Whisper's
+# 30 s window, so each chunk is a single decoder pass
+CHUNK_SECONDS = 28
+# Audio shared by neighbouring chunks, centred on the cut
+OVERLAP_SECONDS = 1.0
+# How far back from the target length to look for a pause to cut at
+SEARCH_SECONDS = 5
+# Frame size used to find the quietest point
+FRAME_SECONDS = 0.02
+
+
+def quietest_point(audio: np.ndarray, start: int, end: int) -> int:
+    """The centre of the lowest-energy frame in audio[start:end]."""
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    frames = (end - start) // frame
+
+    if frames < 1:
+        return end
+
+    window = audio[start : start + frames * frame].reshape(frames, frame)
+    energy = np.einsum("ij,ij->i", window, window)
+
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+
+def plan_chunks(audio: np.ndarray) -> list:
+    """
+    Picks chunk boundaries, cutting at the quietest point in the last
+    SEARCH_SECONDS before each CHUNK_SECONDS mark, so cuts land in pauses
+    whenever there are any.
+
+    Returns:
+        list: (start, end, cut_before, cut_after) sample positions per chunk,
+        where cut_before/cut_after are the cut points shared with the
+        previous/next chunk (None at either end of the recording).
+    """
+    total = audio.shape[0]
+    chunk = CHUNK_SECONDS * SAMPLE_RATE
+    search = SEARCH_SECONDS * SAMPLE_RATE
+    half_overlap = int(OVERLAP_SECONDS * SAMPLE_RATE) // 2
+
+    cuts = []
+    position = 0
+    while total - position > chunk:
+        cut = quietest_point(audio, position + chunk - search, position + chunk)
+        cuts.append(cut)
+        position = cut
+
+    bounds = [None] + cuts + [None]
+    plan = []
+    for before, after in zip(bounds, bounds[1:]):
+        start = 0 if before is None else max(0, before - half_overlap)
+        end = total if after is None else min(total, after + half_overlap)
+        plan.append((start, end, before, after))
+
+    return plan
+
+
+def stitch(chunk_words: list) -> str:
+    """
+    Joins per-chunk words into one transcript. Each chunk keeps only the
+    words whose midpoint falls on its side of the cuts, so a word heard in
+    both halves of an overlap is kept exactly once.
+
+    Args:
+        chunk_words (list): (cut_before, cut_after, words) per chunk, with
+            cuts in seconds (None at the ends) and words as
+            (start, end, text) in absolute seconds.
+    """
+    kept = []
+
+    for cut_before, cut_after, words in chunk_words:
+        for start, end, text in words:
+            middle = (start + end) / 2
+
+            if cut_before is not None and middle < cut_before:
+                continue
+            if cut_after is not None and middle >= cut_after:
+                continue
+
+            kept.append(text)
+
+    return "".join(kept).strip()
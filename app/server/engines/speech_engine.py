@@ -1,3 +1,16 @@
 class SpeechRecognitionEngine:
-    def transcribe(self, file_path: str):
+    def transcribe(self, audio, language: str = None):
+        """
+        Transcribes a file path, or 16 kHz mono float32 PCM as a NumPy array.
+
+        Args:
+            audio: The audio to transcribe.
+            language (str, optional): Language code to decode in. Detected from
+                the audio when not given.
+
+        Returns:
+            dict: "text", "language", "language_probability" (1.0 when the
+            language was given) and "avg_logprob" (mean segment log
+            probability, a rough confidence measure).
+        """
         raise NotImplementedError
@@ -1,15 +1,148 @@
-from faster_whisper import WhisperModel
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from faster_whisper import WhisperModel, decode_audio
 from engines.speech_engine import SpeechRecognitionEngine
+from engines import autotune as tuning
+from engines import chunking
+
+from app.tracing import now_us, tracer
+
+# Concurrent decodes for long recordings. With 1, recordings of any length
+# go through a single ordinary decode; splitting only pays off when the
+# chunks can run side by side.
+CHUNK_WORKERS = 1
 
 
 class WhisperEngine(SpeechRecognitionEngine):
-    def __init__(self, cpu: bool, model: str = "small"):
-        if cpu:
-            self.model = WhisperModel(model, device="cpu", compute_type="int8")
-        else:
-            self.model = WhisperModel(model, device="cuda", compute_type="int8")
-
-    def transcribe(self, file_path: str):
-        segments, info = self.model.transcribe(file_path)
-        segments = " ".join([segment.text.strip() for segment in segments])
-        return segments
+    def __init__(
+        self,
+        cpu: bool,
+        model: str = "small",
+        autotune: bool = False,
+        retune: bool = False,
+        calibration_audio: str = tuning.CALIBRATION_AUDIO,
+        chunk_workers: int = CHUNK_WORKERS,
+    ):
+        device = "cpu" if cpu else "cuda"
+        compute_type = "int8"
+        cpu_threads = 0  # faster-whisper's default
+
+        if autotune or retune:
+            profile = tuning.autotune(model, device, retune=retune, audio_path=calibration_audio)
+            compute_type = profile["compute_type"]
+            cpu_threads = profile["cpu_threads"]
+
+        # Each worker can run one decode at a time with the tuned thread
+        # count; ordinary clips only ever occupy one of them
+        self.chunk_workers = max(1, chunk_workers)
+        self.model = WhisperModel(
+            model,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=self.chunk_workers,
+        )
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.chunk_workers, thread_name_prefix="whisper-chunk"
+        )
+
+    def transcribe(self, audio, language: str = None):
+        if isinstance(audio, str):
+            audio = decode_audio(audio)
+
+        if (
+            self.chunk_workers > 1
+            and audio.shape[0] > chunking.LONG_AUDIO_SECONDS * chunking.SAMPLE_RATE
+        ):
+            return self.transcribe_chunked(audio, language)
+
+        # Feature extraction and language detection happen up front...
+        with tracer.span("whisper.prepare", language=language or "detect"):
+            segments, info = self.model.transcribe(audio, language=language)
+
+        # ...then each segment is decoded as the generator is consumed
+        decoded = []
+        start = now_us()
+        for segment in segments:
+            end = now_us()
+            tracer.record("whisper.segment", start, end, seek=segment.seek)
+            decoded.append(segment)
+            start = end
+        segments = decoded
+
+        text = " ".join([segment.text.strip() for segment in segments])
+        avg_logprob = (
+            sum(segment.avg_logprob for segment in segments) / len(segments)
+            if segments
+            else 0.0
+        )
+
+        return {
+            "text": text,
+            "language": info.language,
+            "language_probability": info.language_probability,
+            "avg_logprob": avg_logprob,
+        }
+
+    def transcribe_chunked(self, audio, language: str = None):
+        """
+        Splits a long recording at pauses into overlapping chunks, decodes
+        them concurrently and stitches the words back together.
+
+        Chunks are views into the recording and only chunk_workers + 1 are
+        in flight at once, so memory stays bounded however long it is.
+        """
+        language_probability = 1.0
+        if language is None:
+            # Every chunk has to agree on the language, so detect it once
+            with tracer.span("whisper.detect_language"):
+                language, language_probability, _ = self.model.detect_language(
+                    audio[: 30 * chunking.SAMPLE_RATE]
+                )
+
+        plan = chunking.plan_chunks(audio)
+        context = tracer.current()
+
+        def decode(start, end):
+            with tracer.resume(context), tracer.span("whisper.chunk", start=start, end=end):
+                segments, _ = self.model.transcribe(
+                    audio[start:end], language=language, word_timestamps=True
+                )
+                segments = list(segments)
+
+            offset = start / chunking.SAMPLE_RATE
+            words = [
+                (offset + word.start, offset + word.end, word.word)
+                for segment in segments
+                for word in segment.words
+            ]
+            return words, [segment.avg_logprob for segment in segments]
+
+        def seconds(position):
+            return None if position is None else position / chunking.SAMPLE_RATE
+
+        chunk_words = []
+        logprobs = []
+        pending = deque()
+
+        def collect():
+            cut_before, cut_after, future = pending.popleft()
+            words, chunk_logprobs = future.result()
+            chunk_words.append((seconds(cut_before), seconds(cut_after), words))
+            logprobs.extend(chunk_logprobs)
+
+        for start, end, cut_before, cut_after in plan:
+            if len(pending) > self.chunk_workers:
+                collect()
+            pending.append((cut_before, cut_after, self.pool.submit(decode, start, end)))
+
+        while pending:
+            collect()
+
+        return {
+            "text": chunking.stitch(chunk_words),
+            "language": language,
+            "language_probability": language_probability,
+            "avg_logprob": sum(logprobs) / len(logprobs) if logprobs else 0.0,
+        }
@@ -1,21 +1,190 @@
 """FastAPI server for modular speech recognition engines"""
 
+import ipaddress
+import os
+import re
+import sys
+
+# Make the app package importable when run as a script
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from engines.whisper_engine import WhisperEngine
+from engines.whisper_engine import CHUNK_WORKERS, WhisperEngine
+from engines.autotune import CALIBRATION_AUDIO
+from multiprocessing import shared_memory
+import numpy as np
 import argparse
 
+from app.tracing import REQUEST_ID_HEADER, TRACE_HEADER, new_request_id, tracer
+from app.transport import PROBE_BYTES, SEGMENT_PREFIX
+
 HOST = "0.0.0.0"
 PORT = 4242
+SAMPLE_RATE = 16000
+MAX_ATTACHED_SEGMENTS = 8
+
+# Ways a client can hand us audio, negotiated via /transports:
+#   shm  - PCM in a shared memory segment owned by the client (same host only)
+#   http - PCM in the request body
+TRANSPORTS = ["shm", "http"]
+
+# Language detection costs an extra encoder pass, so in auto mode the
+# detected language is cached per client session and reused. A detection is
+# only cached when it is at least this confident...
+LANGUAGE_CONFIDENCE = 0.8
+# ...and is dropped again (so the next request re-detects) when decoding in
+# the cached language produces a transcript with a mean log probability
+# below this, which usually means the speaker switched languages.
+MIN_AVG_LOGPROB = -1.0
 
 app = FastAPI()
 
 engine = None
 
+# Language to always decode in, from --language; None means auto
+server_language = None
+
+# Session ID -> detected language, for auto mode
+session_languages = {}
+
+# Segments attached on behalf of clients, by name. Clients reuse one segment
+# across requests, so keeping it mapped saves an attach per utterance.
+attached_segments = {}
+
 
 class TranscribeRequest(BaseModel):
-    file_path: str
+    file_path: str | None = None
+    shm_name: str | None = None
+    samples: int = 0
+    sample_rate: int = SAMPLE_RATE
+
+
+class ShmProbeRequest(BaseModel):
+    shm_name: str
+
+
+def open_segment(name: str) -> shared_memory.SharedMemory:
+    """Maps an existing segment without taking ownership of it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track flag; undo the resource tracker
+        # registration by hand so it doesn't unlink the client's segment
+        from multiprocessing import resource_tracker
+
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def is_local_client(request: Request) -> bool:
+    try:
+        return ipaddress.ip_address(request.client.host).is_loopback
+    except (AttributeError, ValueError):
+        return False
+
+
+def check_segment_access(request: Request, name: str):
+    """
+    Mapping a segment by name reads whatever is in it, so only clients on
+    this machine may ask, and only for segments a Vibrance client created.
+    """
+    if not is_local_client(request):
+        raise HTTPException(
+            status_code=403, detail="Shared memory is only available to local clients"
+        )
+
+    if not re.fullmatch(rf"{SEGMENT_PREFIX}[0-9a-f]+", name):
+        raise HTTPException(status_code=400, detail="Not a Vibrance shared memory segment")
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Maps a client's shared memory segment, dropping the oldest ones once too
+    many are held. The client owns the segment, so it must never be unlinked
+    from this side.
+    """
+    segment = attached_segments.get(name)
+    if segment is not None:
+        return segment
+
+    for stale_name in list(attached_segments)[: -MAX_ATTACHED_SEGMENTS + 1]:
+        try:
+            attached_segments[stale_name].close()
+            del attached_segments[stale_name]
+        except BufferError:
+            pass  # still referenced by an in-flight request
+
+    segment = open_segment(name)
+    attached_segments[name] = segment
+
+    return segment
+
+
+def check_sample_rate(sample_rate: int):
+    if sample_rate != SAMPLE_RATE:
+        raise HTTPException(
+            status_code=400, detail=f"Audio must be {SAMPLE_RATE} Hz PCM"
+        )
+
+
+def resolve_language(request: Request):
+    """
+    Works out which language to decode in for this request.
+
+    Returns:
+        tuple: The language code (None to detect) and whether the result
+        should feed the session's detection cache.
+    """
+    requested = request.headers.get("X-Vibrance-Language", "auto")
+    if requested != "auto":
+        return requested, False
+
+    if server_language:
+        return server_language, False
+
+    session_id = request.headers.get("X-Vibrance-Session")
+    if session_id is None:
+        return None, False
+
+    return session_languages.get(session_id), True
+
+
+def run_transcription(audio, request: Request) -> dict:
+    request_id = request.headers.get(REQUEST_ID_HEADER) or new_request_id()
+    wants_trace = request.headers.get(TRACE_HEADER) == "1"
+
+    with tracer.request(request_id, collect=wants_trace) as spans:
+        with tracer.span("server.transcribe", path=request.url.path):
+            result = transcribe_in_session(audio, request)
+
+    if wants_trace:
+        result["trace"] = spans
+
+    return result
+
+
+def transcribe_in_session(audio, request: Request) -> dict:
+    language, cached = resolve_language(request)
+
+    result = engine.transcribe(audio, language=language)
+
+    if cached:
+        session_id = request.headers.get("X-Vibrance-Session")
+
+        if language is None:
+            if result["language_probability"] >= LANGUAGE_CONFIDENCE:
+                session_languages[session_id] = result["language"]
+        elif result["avg_logprob"] < MIN_AVG_LOGPROB:
+            session_languages.pop(session_id, None)
+
+    return {
+        "text": result["text"],
+        "language": result["language"],
+        "language_probability": result["language_probability"],
+    }
 
 
 @app.get("/health")
@@ -23,10 +192,73 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/transports")
+def transports(http_request: Request):
+    if is_local_client(http_request):
+        return {"transports": TRANSPORTS}
+    return {"transports": [t for t in TRANSPORTS if t != "shm"]}
+
+
+@app.post("/transports/shm-probe")
+def shm_probe(request: ShmProbeRequest, http_request: Request):
+    """
+    Echoes back the start of a client's segment, so the client can tell it
+    really shares memory with us (a forwarded localhost port may not).
+    """
+    check_segment_access(http_request, request.shm_name)
+    try:
+        segment = open_segment(request.shm_name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown shared memory segment")
+
+    try:
+        return {"content": bytes(segment.buf[:PROBE_BYTES]).hex()}
+    finally:
+        segment.close()
+
+
 @app.post("/transcribe/")
-async def transcribe(request: TranscribeRequest):
-    text = engine.transcribe(request.file_path)
-    return {"text": text}
+async def transcribe(request: TranscribeRequest, http_request: Request):
+    if request.shm_name:
+        check_sample_rate(request.sample_rate)
+        check_segment_access(http_request, request.shm_name)
+        try:
+            segment = attach_segment(request.shm_name)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Unknown shared memory segment")
+
+        if not 0 < request.samples <= segment.size // np.dtype(np.float32).itemsize:
+            raise HTTPException(
+                status_code=400, detail="Sample count doesn't fit the shared memory segment"
+            )
+
+        # A view straight onto the client's pages; no copy is made
+        audio = np.ndarray((request.samples,), dtype=np.float32, buffer=segment.buf)
+        result = run_transcription(audio, http_request)
+        del audio
+    elif request.file_path:
+        result = run_transcription(request.file_path, http_request)
+    else:
+        raise HTTPException(status_code=400, detail="No audio given")
+
+    return result
+
+
+@app.post("/transcribe/pcm")
+async def transcribe_pcm(request: Request):
+    try:
+        sample_rate = int(request.headers.get("X-Sample-Rate", SAMPLE_RATE))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Sample-Rate must be an integer")
+    check_sample_rate(sample_rate)
+
+    body = await request.body()
+    if not body or len(body) % np.dtype(np.float32).itemsize:
+        raise HTTPException(status_code=400, detail="Body must be float32 PCM samples")
+
+    audio = np.frombuffer(body, dtype=np.float32)
+
+    return run_transcription(audio, request)
 
 
 def parse_arguments():
@@ -42,6 +274,39 @@ def parse_arguments():
         "--cpu", action="store_true", help="Force CPU usage for the model"
     )
     parser.add_argument("--model", type=str, default="small", help="Model size to use")
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Pick the fastest compute type and thread count for this host, calibrating once and caching the result",
+    )
+    parser.add_argument(
+        "--retune",
+        action="store_true",
+        help="Like --autotune, but ignore any cached profile and calibrate again",
+    )
+    parser.add_argument(
+        "--calibration-audio",
+        type=str,
+        default=CALIBRATION_AUDIO,
+        help="Audio file with speech to use for autotune calibration",
+    )
+    parser.add_argument(
+        "--chunk-workers",
+        type=int,
+        default=CHUNK_WORKERS,
+        help="Decode recordings over a minute as this many chunks at once; 1 (default) decodes them in one pass",
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        default="auto",
+        help="Language code to always transcribe in (e.g. en), or auto to detect once per client session",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write spans for every request to this file as Chrome/Perfetto trace-event JSON",
+    )
     parser.add_argument("--host", type=str, default=HOST, help="Host for the server")
     parser.add_argument("--port", type=int, default=PORT, help="Port for the server")
     parser.add_argument(
@@ -54,20 +319,30 @@ def parse_arguments():
     return parser.parse_args()
 
 
-def initialize_engine(engine_name: str, cpu: bool, model: str):
+def initialize_engine(engine_name: str, cpu: bool, model: str, args=None):
     """
     Initializes the selected speech recognition engine.
     """
     if engine_name == "whisper":
-        return WhisperEngine(cpu, model=model)
+        return WhisperEngine(
+            cpu,
+            model=model,
+            autotune=args.autotune if args else False,
+            retune=args.retune if args else False,
+            calibration_audio=args.calibration_audio if args else CALIBRATION_AUDIO,
+            chunk_workers=args.chunk_workers if args else CHUNK_WORKERS,
+        )
     else:
         raise ValueError(f"Unknown engine: {engine_name}")
 
 
 def run_server():
-    global engine
+    global engine, server_language
     args = parse_arguments()
-    engine = initialize_engine(args.engine, args.cpu, args.model)
+    server_language = None if args.language == "auto" else args.language
+    if args.trace:
+        tracer.configure(args.trace, process_name="vibrance-server")
+    engine = initialize_engine(args.engine, args.cpu, args.model, args)
     uvicorn.run(app, host=args.host, port=args.port, log_level="error")
 
 
@@ -0,0 +1,225 @@
+"""Request-scoped span tracing with Chrome/Perfetto trace-event export"""
+
+import gc
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Sent by the client when it wants the server's spans back in the response
+TRACE_HEADER = "X-Vibrance-Trace"
+
+MAX_TRACE_BYTES = 16 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+
+def now_us() -> int:
+    """
+    Wall clock time in microseconds, the unit trace events use. Wall time
+    (rather than a monotonic clock) keeps client and server spans on the
+    same timeline.
+    """
+    return time.time_ns() // 1000
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Tracer:
+    """
+    Records complete ("X") trace events for spans of work, tagged with the
+    request ID active on the current thread.
+
+    Events go to a rolling file in the Chrome trace-event JSON array format,
+    which chrome://tracing and ui.perfetto.dev both open. The closing bracket
+    is optional in that format, so events are simply appended one per line
+    and the file is rotated once it grows past max_bytes.
+
+    Events can also be collected per request, which is how the server hands
+    its spans back to the client so one trace file covers both sides.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.process_name = "vibrance"
+        self.max_bytes = MAX_TRACE_BYTES
+        self.backups = TRACE_BACKUPS
+
+        self._file = None
+        # Re-entrant: a GC callback can fire while this thread is mid-write
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._gc_start = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def configure(
+        self,
+        path: str,
+        process_name: str = "vibrance",
+        max_bytes: int = MAX_TRACE_BYTES,
+        backups: int = TRACE_BACKUPS,
+    ):
+        """Starts writing trace events to the given file."""
+        self.path = path
+        self.process_name = process_name
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        with self._lock:
+            self._open()
+
+        gc.callbacks.append(self._on_gc)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    @property
+    def request_id(self):
+        return getattr(self._local, "request_id", None)
+
+    @contextmanager
+    def request(self, request_id: str, collect: bool = False):
+        """
+        Tags spans recorded on this thread with a request ID.
+
+        Yields:
+            list | None: If collect is set, a list that receives every event
+            recorded on this thread for the request.
+        """
+        previous = (self.request_id, getattr(self._local, "collected", None))
+
+        self._local.request_id = request_id
+        self._local.collected = [] if collect else None
+
+        try:
+            yield self._local.collected
+        finally:
+            self._local.request_id, self._local.collected = previous
+
+    def current(self) -> tuple:
+        """The request context of this thread, for handing to resume()."""
+        return (self.request_id, getattr(self._local, "collected", None))
+
+    @contextmanager
+    def resume(self, context: tuple):
+        """Continues a request captured with current() on another thread."""
+        previous = self.current()
+
+        self._local.request_id, self._local.collected = context
+
+        try:
+            yield
+        finally:
+            self._local.request_id, self._local.collected = previous
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """Records the duration of the enclosed block as a span."""
+        if not self.enabled and getattr(self._local, "collected", None) is None:
+            yield
+            return
+
+        start = now_us()
+        try:
+            yield
+        finally:
+            self.record(name, start, now_us(), **args)
+
+    def record(self, name: str, start: int, end: int, request_id: str = None, **args):
+        """Records a span that has already finished."""
+        collected = getattr(self._local, "collected", None)
+
+        if not self.enabled and collected is None:
+            return
+
+        request_id = request_id or self.request_id
+        if request_id:
+            args["request_id"] = request_id
+
+        event = {
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": start,
+            "dur": max(0, end - start),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+
+        if collected is not None:
+            collected.append(event)
+
+        self.write([event])
+
+    def write(self, events: list):
+        """Appends events, e.g. ones returned by the server, to the trace file."""
+        if not self.enabled or not events:
+            return
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            for event in events:
+                self._file.write(json.dumps(event) + ",\n")
+
+            if self._file.tell() > self.max_bytes:
+                self._rotate()
+
+    def _open(self):
+        self._file = open(self.path, "w", buffering=1)
+        self._file.write("[\n")
+        self._file.write(
+            json.dumps(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "args": {"name": self.process_name},
+                }
+            )
+            + ",\n"
+        )
+
+    def _rotate(self):
+        self._file.close()
+
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+
+        self._open()
+
+    def _on_gc(self, phase: str, info: dict):
+        if phase == "start":
+            self._gc_start = now_us()
+        elif self._gc_start is not None:
+            self.record(
+                "gc.collect",
+                self._gc_start,
+                now_us(),
+                generation=info.get("generation"),
+                collected=info.get("collected"),
+            )
+            self._gc_start = None
+
+
+tracer = Tracer()
@@ -0,0 +1,209 @@
+"""Transports for getting captured audio to the transcription server"""
+
+import os
+import secrets
+from multiprocessing import shared_memory
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+from app.audio import WHISPER_SAMPLE_RATE
+from app.tracing import REQUEST_ID_HEADER, TRACE_HEADER, tracer
+
+LOCAL_HOSTS = ["localhost", "127.0.0.1", "::1"]
+TRANSPORTS = ["auto", "shm", "http"]
+
+# Shared memory segments are grown in steps of this size so that a slightly
+# longer clip doesn't force a new segment every time
+SEGMENT_STEP = 1024 * 1024
+
+# Segments are named with this prefix plus random hex; the server refuses to
+# map anything else
+SEGMENT_PREFIX = "vibrance_"
+PROBE_BYTES = 16
+
+
+def create_segment(size: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(
+        name=f"{SEGMENT_PREFIX}{secrets.token_hex(8)}", create=True, size=size
+    )
+
+
+class HttpTransport:
+    """
+    Posts raw float32 PCM in the request body. Works against any server,
+    local or remote.
+    """
+
+    name = "http"
+
+    def __init__(self, server_host: str, headers: dict = None):
+        self.server_host = server_host
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def request_headers(self, request_id: str = None) -> dict:
+        headers = {}
+        if request_id:
+            headers[REQUEST_ID_HEADER] = request_id
+        if tracer.enabled:
+            headers[TRACE_HEADER] = "1"
+        return headers
+
+    def transcribe(self, audio: np.ndarray, timeout=None, request_id: str = None) -> dict:
+        """
+        Returns:
+            dict: The server's response; if tracing is on it includes the
+            server's spans under "trace".
+        """
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+
+        response = self.session.post(
+            f"{self.server_host}/transcribe/pcm",
+            data=audio.tobytes(),
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Sample-Rate": str(WHISPER_SAMPLE_RATE),
+                **self.request_headers(request_id),
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class SharedMemoryTransport(HttpTransport):
+    """
+    Copies PCM into a shared memory segment and only sends the segment name
+    over HTTP; the server maps the same pages as a NumPy array, so the audio
+    itself never crosses the socket. Only usable when client and server
+    share a host.
+
+    The segment is owned by the client and reused between requests. Requests
+    on one transport must not overlap, which the pipeline's single
+    transcribe worker guarantees.
+    """
+
+    name = "shm"
+
+    def __init__(self, server_host: str, headers: dict = None):
+        super().__init__(server_host, headers)
+        self.segment = None
+
+    def _ensure_capacity(self, nbytes: int):
+        if self.segment is not None and self.segment.size >= nbytes:
+            return
+
+        self._release()
+
+        size = max(SEGMENT_STEP, -(-nbytes // SEGMENT_STEP) * SEGMENT_STEP)
+        self.segment = create_segment(size)
+
+    def transcribe(self, audio: np.ndarray, timeout=None, request_id: str = None) -> dict:
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        self._ensure_capacity(audio.nbytes)
+
+        with tracer.span("transport.shm_write", bytes=audio.nbytes):
+            view = np.ndarray(audio.shape, dtype=np.float32, buffer=self.segment.buf)
+            view[:] = audio
+            del view  # the segment can't be closed while a view is exported
+
+        response = self.session.post(
+            f"{self.server_host}/transcribe/",
+            json={
+                "shm_name": self.segment.name,
+                "samples": audio.shape[0],
+                "sample_rate": WHISPER_SAMPLE_RATE,
+            },
+            headers=self.request_headers(request_id),
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _release(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+    def close(self):
+        self._release()
+        super().close()
+
+
+def is_local_host(server_host: str) -> bool:
+    return urlparse(server_host).hostname in LOCAL_HOSTS
+
+
+def shm_reachable(server_host: str) -> bool:
+    """
+    Checks that the server can actually read our shared memory, by having it
+    echo a random token back from a small probe segment. A localhost URL can
+    still lead to another machine or container through a forwarded port.
+    """
+    token = os.urandom(PROBE_BYTES)
+    segment = create_segment(PROBE_BYTES)
+
+    try:
+        segment.buf[:PROBE_BYTES] = token
+        response = requests.post(
+            f"{server_host}/transports/shm-probe",
+            json={"shm_name": segment.name},
+            timeout=5,
+        )
+        return response.ok and response.json().get("content") == token.hex()
+    except requests.exceptions.RequestException:
+        return False
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def negotiate_transport(server_host: str, preferred: str = "auto", headers: dict = None):
+    """
+    Picks a transport that both sides support.
+
+    Args:
+        server_host (str): Base URL of the transcription server.
+        preferred (str): "auto", "shm" or "http". "auto" uses shared memory
+            when the server offers it and can read a probe segment written
+            here, otherwise HTTP.
+        headers (dict, optional): Headers sent with every transcription
+            request, e.g. the session ID and language.
+
+    Returns:
+        HttpTransport | SharedMemoryTransport: The transport to use.
+
+    Raises:
+        ValueError: If "shm" is requested but is not available.
+    """
+    if preferred == "http":
+        return HttpTransport(server_host, headers)
+
+    try:
+        response = requests.get(f"{server_host}/transports", timeout=5)
+        response.raise_for_status()
+        offered = response.json().get("transports", [])
+    except requests.exceptions.RequestException:
+        offered = []
+
+    shm_usable = (
+        "shm" in offered
+        and is_local_host(server_host)
+        and shm_reachable(server_host)
+    )
+
+    if preferred == "shm" and not shm_usable:
+        raise ValueError(
+            "Shared memory transport is only available with a server on this machine"
+        )
+
+    if shm_usable:
+        return SharedMemoryTransport(server_host, headers)
+
+    return HttpTransport(server_host, headers)
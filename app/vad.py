@@ -0,0 +1,231 @@
+"""Hands-free dictation: cutting a continuous input stream into utterances"""
+
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+# A block counts as speech when its RMS is this many times the noise floor...
+SPEECH_RATIO = 3.0
+# ...and above this absolute level, so a silent room doesn't trigger on hiss
+MIN_SPEECH_RMS = 0.01
+# How quickly the noise floor follows the level during silence (per block)
+NOISE_ADAPTATION = 0.05
+# The floor never stays below the quietest block of this window, even while
+# speaking. Pauses between words keep that minimum near the background level,
+# but a sustained rise (a fan turning on) is picked up within the window
+# instead of reading as one endless utterance.
+NOISE_WINDOW_SECONDS = 3.0
+
+ONSET_SECONDS = 0.1
+PRE_ROLL_SECONDS = 0.3
+SILENCE_SECONDS = 0.7
+MIN_SPEECH_SECONDS = 0.3
+MAX_UTTERANCE_SECONDS = 30.0
+
+
+def block_rms(block: np.ndarray) -> float:
+    return float(np.sqrt(np.mean(np.square(block, dtype=np.float32))))
+
+
+class UtteranceSegmenter:
+    """
+    Streaming energy-based voice activity detector.
+
+    Blocks are fed in as they are captured. An utterance starts after
+    ONSET_SECONDS of continuous speech (keeping PRE_ROLL_SECONDS of audio
+    from before it, so soft word starts aren't clipped) and ends after
+    SILENCE_SECONDS without speech, or when it reaches MAX_UTTERANCE_SECONDS.
+    The speech threshold tracks the background level, so it adapts to the
+    microphone and the room, including while someone is speaking.
+
+    Callbacks:
+        on_start(): Speech was detected and an utterance has begun.
+        on_utterance(blocks): The utterance ended; blocks is its audio.
+        on_discard(): The utterance ended with too little speech to be worth
+            transcribing (a cough, a door).
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        on_start: callable = None,
+        on_utterance: callable = None,
+        on_discard: callable = None,
+    ):
+        self.sample_rate = sample_rate
+        self.on_start = on_start or (lambda: None)
+        self.on_utterance = on_utterance or (lambda blocks: None)
+        self.on_discard = on_discard or (lambda: None)
+
+        self.noise_floor = None
+        self.speaking = False
+
+        # (position, rms) of the blocks that could still be the window's
+        # minimum, quietest first
+        self._quietest = deque()
+        self._position = 0
+
+        self._pre_roll = deque()
+        self._pre_roll_samples = 0
+        self._onset_samples = 0
+        self._blocks = []
+        self._samples = 0
+        self._speech_samples = 0
+        self._silence_samples = 0
+
+    def _seconds(self, seconds: float) -> int:
+        return int(seconds * self.sample_rate)
+
+    def feed(self, block: np.ndarray):
+        frames = block.shape[0]
+        rms = block_rms(block)
+
+        if self.noise_floor is None:
+            self.noise_floor = rms
+
+        is_speech = rms > max(self.noise_floor * SPEECH_RATIO, MIN_SPEECH_RMS)
+
+        if not is_speech:
+            # Drop quickly when it gets quieter, rise slowly when it gets louder
+            if rms < self.noise_floor:
+                self.noise_floor = rms
+            else:
+                self.noise_floor += (rms - self.noise_floor) * NOISE_ADAPTATION
+
+        self._track_quietest(frames, rms)
+        self.noise_floor = max(self.noise_floor, self._quietest[0][1])
+
+        if self.speaking:
+            self._continue(block, frames, is_speech)
+        else:
+            self._wait_for_onset(block, frames, is_speech)
+
+    def _track_quietest(self, frames: int, rms: float):
+        self._position += frames
+
+        while self._quietest and self._quietest[-1][1] >= rms:
+            self._quietest.pop()
+        self._quietest.append((self._position, rms))
+
+        while self._quietest[0][0] <= self._position - self._seconds(NOISE_WINDOW_SECONDS):
+            self._quietest.popleft()
+
+    def _wait_for_onset(self, block: np.ndarray, frames: int, is_speech: bool):
+        self._pre_roll.append(block)
+        self._pre_roll_samples += frames
+
+        while (
+            self._pre_roll_samples - self._pre_roll[0].shape[0]
+            >= self._seconds(PRE_ROLL_SECONDS)
+        ):
+            self._pre_roll_samples -= self._pre_roll.popleft().shape[0]
+
+        self._onset_samples = self._onset_samples + frames if is_speech else 0
+
+        if self._onset_samples >= self._seconds(ONSET_SECONDS):
+            self.speaking = True
+            self._blocks = list(self._pre_roll)
+            self._samples = self._pre_roll_samples
+            self._speech_samples = self._onset_samples
+            self._silence_samples = 0
+            self._pre_roll.clear()
+            self._pre_roll_samples = 0
+            self._onset_samples = 0
+
+            self.on_start()
+
+    def _continue(self, block: np.ndarray, frames: int, is_speech: bool):
+        self._blocks.append(block)
+        self._samples += frames
+
+        if is_speech:
+            self._speech_samples += frames
+            self._silence_samples = 0
+        else:
+            self._silence_samples += frames
+
+        if self._silence_samples >= self._seconds(SILENCE_SECONDS):
+            self._end()
+        elif self._samples >= self._seconds(MAX_UTTERANCE_SECONDS):
+            # Still talking; cut here and carry straight on into a new one
+            self._end()
+            if is_speech:
+                self.speaking = True
+                self._blocks = []
+                self._samples = 0
+                self._speech_samples = 0
+                self._silence_samples = 0
+                self.on_start()
+
+    def _end(self):
+        blocks = self._blocks
+        enough = self._speech_samples >= self._seconds(MIN_SPEECH_SECONDS)
+
+        self.speaking = False
+        self._blocks = []
+        self._samples = 0
+
+        if enough:
+            self.on_utterance(blocks)
+        else:
+            self.on_discard()
+
+
+class ContinuousDictation(threading.Thread):
+    """
+    Runs the segmenter off the audio thread and feeds each utterance into
+    the pipeline as a job, so one utterance is transcribed and typed while
+    the next is still being captured.
+
+    The input stream callback only calls feed(), which copies the block onto
+    a queue.
+    """
+
+    def __init__(self, core, pipeline, sample_rate: int, on_state: callable = None):
+        super().__init__(name="vibrance-vad", daemon=True)
+        self.core = core
+        self.pipeline = pipeline
+        self.sample_rate = sample_rate
+        self.on_state = on_state or (lambda speaking: None)
+
+        self.job = None
+        self._blocks = queue.Queue()
+        self.segmenter = UtteranceSegmenter(
+            sample_rate,
+            on_start=self._start_job,
+            on_utterance=self._submit_job,
+            on_discard=self._discard_job,
+        )
+
+    def feed(self, block: np.ndarray):
+        self._blocks.put(block.copy())
+
+    def stop(self):
+        self._blocks.put(None)
+
+    def run(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                return
+            self.segmenter.feed(block)
+
+    def _start_job(self):
+        # Created at speech onset so selection capture and LLM prewarming
+        # overlap with the rest of the utterance, as with push-to-talk
+        self.job = self.pipeline.new_job(self.sample_rate)
+        self.core.prepare_context(self.job)
+        self.on_state(True)
+
+    def _submit_job(self, blocks: list):
+        self.job.audio_blocks = blocks
+        self.pipeline.submit(self.job)
+        self.job = None
+        self.on_state(False)
+
+    def _discard_job(self):
+        self.pipeline.discard(self.job)
+        self.job = None
+        self.on_state(False)
@@ -1,30 +1,24 @@
 #!/usr/bin/env python3
 
-import os
-import subprocess
-import requests
 import time
 from rich import print
 from rich.progress import Progress
 from rich.console import Console
 from rich.text import Text
-import numpy as np
 import sounddevice as sd
-from scipy.io import wavfile
 import sys
+import threading
 import argparse
 from datetime import datetime
 
 from pynput.keyboard import Controller as KeyboardController, Key, Listener
 
-from app.keyboard import keyboard_controller
-from app.macros import MACROS
+from app.core import JOB_POLICIES, VibranceCore, list_input_devices
+from app.history import HISTORY_DAYS, HISTORY_DIR, HISTORY_MAX_MB, HistoryWriter
+from app.tracing import tracer
+from app.vad import ContinuousDictation
+from app.transport import TRANSPORTS
 
-from pyperclip import paste as clipboard_paste
-
-from app.core import VibranceCore, list_input_devices
-
-MIN_SAMPLES_FOR_TRANSCRIBE = 8000
 VOICEKEY_DEFAULT = "shift_r"  # + CTRL
 
 DEFAULT_HOST = "http://localhost"
@@ -77,6 +71,23 @@ def parse_arguments():
         help="Model size to use",
         choices=["tiny", "base", "small", "medium", "large", "large-v2"],
     )
+    parser.add_argument(
+        "--language",
+        type=str,
+        default="auto",
+        help="Language code to transcribe in (e.g. en), or auto to detect it once and reuse it",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Have the server calibrate compute type and threads for this host (cached after the first run)",
+    )
+    parser.add_argument(
+        "--chunk-workers",
+        type=int,
+        default=1,
+        help="Decode recordings over a minute as this many chunks at once (1 decodes them in one pass)",
+    )
     parser.add_argument(
         "--copy-selection",
         action="store_true",
@@ -88,6 +99,50 @@ def parse_arguments():
         default=0.01,
         help="Set the typing delay in seconds between keypresses (0.01s default)",
     )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="Listen all the time and transcribe each utterance when you pause, instead of using push-to-talk",
+    )
+    parser.add_argument(
+        "--job-policy",
+        type=str,
+        choices=JOB_POLICIES,
+        default="queue",
+        help="What a new dictation does to ones still being processed: queue behind them or preempt (cancel) them",
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        choices=TRANSPORTS,
+        default="auto",
+        help="How audio is sent to the server: shared memory (local only), HTTP, or auto to pick the fastest available",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write per-stage spans for every dictation, client and server side, to this file as Chrome/Perfetto trace-event JSON",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Keep every dictation's audio and transcript in a searchable history (see vibrance_history.py)",
+    )
+    parser.add_argument(
+        "--history-dir", type=str, default=HISTORY_DIR, help="Where to keep the history"
+    )
+    parser.add_argument(
+        "--history-days",
+        type=float,
+        default=HISTORY_DAYS,
+        help=f"Delete history entries older than this many days ({HISTORY_DAYS} default)",
+    )
+    parser.add_argument(
+        "--history-max-mb",
+        type=float,
+        default=HISTORY_MAX_MB,
+        help=f"Delete the oldest history audio beyond this many megabytes ({HISTORY_MAX_MB} default)",
+    )
     parser.add_argument(
         "--list-devices", action="store_true", help="List available input devices"
     )
@@ -103,127 +158,6 @@ def get_device_config(device_index):
     return int(device_info["default_samplerate"]), device_info["max_input_channels"]
 
 
-def wait_for_server(timeout=1800, interval=0.5):
-    """
-    Waits for a server to become available by periodically sending a health check request.
-
-    Args:
-        timeout (int, optional): The maximum time to wait for the server to start, in seconds. Defaults to 1800 seconds (30 minutes).
-        interval (float, optional): The time interval between consecutive health check requests, in seconds. Defaults to 0.5 seconds.
-
-    Returns:
-        bool: True if the server becomes available within the timeout period.
-
-    Raises:
-        TimeoutError: If the server does not become available within the specified timeout period.
-    """
-
-    global keyboard_controller
-
-    start_time = time.time()
-
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(f"{SERVER_HOST}/health", timeout=5)
-            if response.status_code == 200:
-                return True
-        except requests.exceptions.RequestException:
-            pass
-        time.sleep(interval)
-
-    raise TimeoutError("Server failed to start within timeout")
-
-
-def process_typed(
-    dictated_text,
-    args,
-    start_progress: callable,
-    stop_progress: callable,
-    clipboard_contents=None,
-):
-    """
-    Processes the given text input, applying transformations or executing macros
-    based on predefined rules.
-    Args:
-        dictated_text (str): The input text to be processed.
-        args (argparse.Namespace): Parsed command-line arguments.
-    Behavior:
-        - If mode is "default":
-            - Converts the input text to lowercase and removes non-alphanumeric characters.
-            - Checks if the processed text matches any key in the MACROS dictionary.
-            - If a match is found:
-                - If the corresponding value is callable, executes the function and clears the text.
-                - Otherwise, replaces the text with the corresponding value from the MACROS dictionary.
-        - Mode "raw": Simply types the dictated text without any processing.
-        - Mode "llm": Calls Ollama to generate a response based on the input text.
-        - Mode "code" Calls Ollama with a specialized prompt and structured response to help ensure we're getting code back.
-    """
-
-    if args.mode == "default":
-        sluggified = "".join(char for char in dictated_text.lower() if char.isalnum())
-
-        for key, value in MACROS.items():
-            if sluggified == key:
-
-                if callable(value):
-                    # If the value is a callable function, execute it
-                    # This allows for special keys like 'up', 'down', etc.
-                    print(f"Matched '{key}' in '{sluggified}' -> Executing function")
-                    value()
-
-                    dictated_text = ""
-                else:
-                    print(
-                        f"Matched '{key}' in '{sluggified}' -> Replacing with '{value}'"
-                    )
-                    # Replace the matched key with its corresponding value
-                    dictated_text = value
-                    break
-    elif args.mode in ["code", "llm"]:
-
-        start_progress("[purple bold]Inferring...[/purple bold]")
-
-        if args.mode == "code":
-            from app.mode.code import fetch_code
-
-            dictated_text = fetch_code(dictated_text, clipboard_contents)
-
-        elif args.mode == "llm":
-            from app.mode.llm import fetch_response
-
-            dictated_text = fetch_response(dictated_text, clipboard_contents)
-
-        stop_progress()
-
-        dictated_text = dictated_text.strip() + "\n"
-
-        print(f"[yellow bold]>>> Generated response:[/yellow bold]\n{dictated_text}")
-
-        for char in dictated_text:
-            if char == "\n":
-                # for some reason we need to slow down when hitting ENTER or
-                # they get skipped sometimes
-                keyboard_controller.press(Key.enter)
-                time.sleep(0.2)
-                keyboard_controller.release(Key.enter)
-                time.sleep(0.2)
-            elif char == "\t":
-                keyboard_controller.type("    ")
-                pass
-            else:
-                keyboard_controller.press(char)
-                time.sleep(args.typing_delay)
-                keyboard_controller.release(char)
-
-        return
-
-    if dictated_text:
-        for char in dictated_text:
-            keyboard_controller.press(char)
-            time.sleep(args.typing_delay)
-            keyboard_controller.release(char)
-
-
 def display_banner():
     """
     Displays a banner with the word 'Vibrance', where each line rotates in color.
@@ -255,7 +189,7 @@ def display_banner():
 
 
 def main():
-    global keyboard_controller, SERVER_HOST
+    global SERVER_HOST
 
     display_banner()  # Display the banner only if it's April 1st
 
@@ -271,16 +205,31 @@ def main():
         )
         sys.exit(1)
 
+    if args.continuous and args.job_policy == "preempt":
+        print(
+            "[red]Error: --continuous queues every utterance and can't be used with --job-policy preempt.[/red]"
+        )
+        sys.exit(1)
+
     add_space = not args.no_space
 
-    recording = False
-    audio_data = []
+    if args.trace:
+        tracer.configure(args.trace, process_name="vibrance")
+
+    current_job = None
+    pipeline = None
+    dictation = None
+    history_writer = None
+    sample_rate = None
 
     pressed_ctrl = False
     pressed_shift = False
 
+    # Several threads show status at once (recording, transcribing and
+    # inferring for overlapping jobs), so each gets its own task
     progress = Progress()
-    progress_current = None
+    progress_lock = threading.Lock()
+    recording_task = None
 
     def on_press(key):
         """
@@ -288,15 +237,16 @@ def main():
         This function listens for specific key combinations and updates the state
         of the recording process. It checks for the right control key (`Key.ctrl_r`)
         and the right shift key (`Key.shift_r`). When both keys are pressed
-        simultaneously, it starts recording by setting the `recording` flag to True,
-        initializes the `audio_data` list, stops any ongoing progress display, and
-        starts a new progress display indicating that recording is in progress.
+        simultaneously, it starts recording by asking the pipeline for a new job
+        (which, depending on the job policy, may cancel jobs still in flight),
+        kicks off selection capture and LLM prewarming for it, and adds a
+        progress display indicating that recording is in progress.
 
         Args:
             key: The key event object representing the key that was pressed.
         """
 
-        nonlocal recording, audio_data, pressed_ctrl, pressed_shift
+        nonlocal current_job, pressed_ctrl, pressed_shift, recording_task
 
         if key == Key.ctrl_r:
             pressed_ctrl = True
@@ -304,13 +254,11 @@ def main():
         if key == Key.shift_r:
             pressed_shift = True
 
-        if pressed_ctrl and pressed_shift:
-            recording = True
-            audio_data = []
+        if pressed_ctrl and pressed_shift and current_job is None:
+            current_job = pipeline.new_job(sample_rate)
+            core.prepare_context(current_job)
 
-            stop_progress()
-
-            start_progress("[green bold]Recording...[/bold green]")
+            recording_task = start_progress("[green bold]Recording...[/bold green]")
 
     def on_release(key):
         """
@@ -320,13 +268,12 @@ def main():
             key: The key that was released.
 
         Notes:
-            - The function uses nonlocal variables: `recording`, `audio_data`, `pressed_shift`, and `pressed_ctrl`.
-            - Ensures that the recorded audio has a minimum length before attempting transcription.
-            - Handles exceptions during audio processing and transcription requests gracefully.
+            - The function uses nonlocal variables: `current_job`, `pressed_shift`, and `pressed_ctrl`.
+            - Only hands the captured job to the pipeline; encoding, transcription,
+              post-processing and typing all happen on the pipeline's workers so
+              the listener thread is free for the next key event.
         """
-        nonlocal recording, audio_data, pressed_shift, pressed_ctrl
-
-        clipboard_contents = ""
+        nonlocal current_job, pressed_shift, pressed_ctrl, recording_task
 
         if key == Key.ctrl_r:
             pressed_ctrl = False
@@ -334,113 +281,88 @@ def main():
         if key == Key.shift_r:
             pressed_shift = False
 
-        if recording and (pressed_shift == False and pressed_ctrl == False):
-            recording = False
-
-            stop_progress()
+        if current_job is not None and (pressed_shift == False and pressed_ctrl == False):
+            job = current_job
+            current_job = None
 
-            if args.copy_selection:
-                keyboard_controller.press(Key.ctrl)
-                keyboard_controller.press("c")
-                keyboard_controller.release("c")
-                keyboard_controller.release(Key.ctrl)
-                clipboard_contents = clipboard_paste().strip()
-                print(f"[yellow]Selection contents: {clipboard_contents}[/yellow]")
+            stop_progress(recording_task)
+            recording_task = None
 
-            try:
-                audio_data_np = np.concatenate(audio_data, axis=0)
-            except ValueError as e:
-                print(e)
-                return
+            pipeline.submit(job)
 
-            recording_path = os.path.abspath("recording.wav")
-            audio_data_int16 = (audio_data_np * np.iinfo(np.int16).max).astype(np.int16)
+    def stop_progress(task_id=None):
+        with progress_lock:
+            if task_id in progress.task_ids:
+                progress.remove_task(task_id)
 
-            if audio_data_int16.shape[0] < MIN_SAMPLES_FOR_TRANSCRIBE:
-                # Ensure there's enough data for Whisper to process
-                stop_progress()
-                print("[yellow]>>> (Ignoring short response.)[/yellow]", end="")
-                return
-
-            wavfile.write(recording_path, sample_rate, audio_data_int16)
-
-            try:
-                start_progress("[yellow bold]Transcribing...[/bold yellow]")
-
-                response = requests.post(
-                    f"{SERVER_HOST}/transcribe",
-                    json={"file_path": recording_path},
-                )
-
-                stop_progress()
-
-                response.raise_for_status()
-                transcript = response.json()["text"]
-
-                if transcript:
-                    processed_transcript = transcript
-                    if add_space:
-                        processed_transcript += " "
-                    print(
-                        f'[yellow bold]>>>[/bold yellow] [white bold]"{processed_transcript}"[/bold white]'
-                    )
-                    process_typed(
-                        processed_transcript,
-                        args,
-                        start_progress,
-                        stop_progress,
-                        clipboard_contents=clipboard_contents,
-                    )
-
-            except requests.exceptions.RequestException as e:
-                print(f"[red]Error sending request to local API:[/red] {e}")
-            except Exception as e:
-                print(f"[red]Error processing transcript:[/red] {e}")
-            finally:
-
-                pressed_shift = False
-                pressed_ctrl = False
-
-    def stop_progress():
-        nonlocal progress_current
-
-        if progress_current is not None:
-            progress.remove_task(progress_current)
-            progress.stop()
-
-        progress_current = None
+            if not progress.task_ids:
+                progress.stop()
 
     def start_progress(label: str):
-        nonlocal progress_current
+        with progress_lock:
+            if not progress.task_ids:
+                progress.start()
 
-        stop_progress()
+            return progress.add_task(label, total=None)
 
-        progress.start()
+    def show_speaking(speaking: bool):
+        nonlocal recording_task
 
-        progress_current = progress.add_task(label, total=None)
+        if speaking:
+            recording_task = start_progress("[green bold]Hearing speech...[/bold green]")
+        else:
+            stop_progress(recording_task)
+            recording_task = None
 
     def input_stream_callback(indata, frames, time, status):
         if status:
             # print(status)
             pass
-        if recording:
-            audio_data.append(indata.copy())
+        if dictation is not None:
+            dictation.feed(indata)
+            return
+        job = current_job
+        if job is not None:
+            job.audio_blocks.append(indata.copy())
 
     try:
         SERVER_HOST = f"{args.host}:{args.port}"
 
         # Pass the --cpu flag to the server process if specified
-        core = VibranceCore(input_device=args.input_device)
-        server_process = core.start_server(cpu=args.cpu, model=args.model)
+        core = VibranceCore(
+            input_device=args.input_device,
+            server_host=SERVER_HOST,
+            mode=args.mode,
+            typing_delay=args.typing_delay,
+            add_space=add_space,
+            language=args.language,
+            copy_selection=args.copy_selection,
+            start_progress=start_progress,
+            stop_progress=stop_progress,
+        )
+        core.start_server(
+            cpu=args.cpu,
+            model=args.model,
+            autotune=args.autotune,
+            chunk_workers=args.chunk_workers,
+        )
 
         print(f"[yellow]Waiting for the server to be ready...[/yellow]")
 
-        wait_for_server()
+        core.wait_for_server()
+
+        core.connect(args.transport)
+        print(f"[yellow]Using {core.transport.name} transport[/yellow]")
 
         print(MODE_WELCOME[args.mode])
-        print(
-            f"[green]Transcriber is active. Hold down CTRL+SHIFT to start dictating.[/green]"
-        )
+        if args.continuous:
+            print(
+                f"[green]Transcriber is active. Just start talking; each pause ends an utterance.[/green]"
+            )
+        else:
+            print(
+                f"[green]Transcriber is active. Hold down CTRL+SHIFT to start dictating.[/green]"
+            )
 
         if core.input_device is not None:
             sample_rate, max_channels = get_device_config(core.input_device)
@@ -449,7 +371,33 @@ def main():
         else:
             sample_rate, max_channels = 44100, 1  # Fallback defaults
 
-        with Listener(on_press=on_press, on_release=on_release) as listener:
+        if args.history:
+            history_writer = HistoryWriter(
+                args.history_dir,
+                model=args.model,
+                max_days=args.history_days,
+                max_mb=args.history_max_mb,
+            )
+            history_writer.start()
+
+        pipeline = core.build_pipeline(
+            policy=args.job_policy,
+            on_finish=(
+                (lambda job: history_writer.record(job, args.mode))
+                if history_writer
+                else None
+            ),
+        )
+
+        if args.continuous:
+            dictation = ContinuousDictation(
+                core,
+                pipeline,
+                sample_rate,
+                on_state=show_speaking,
+            )
+            dictation.start()
+
             with sd.InputStream(
                 callback=input_stream_callback,
                 channels=max_channels,
@@ -459,14 +407,35 @@ def main():
                 print(
                     f"[green]Listening on device: {sd.query_devices(core.input_device)['name'] if isinstance(sd.query_devices(core.input_device), dict) and 'name' in sd.query_devices(core.input_device) else 'System Default'}[/green]"
                 )
-                listener.join()
-    except TimeoutError as e:
+                threading.Event().wait()
+        else:
+            with Listener(on_press=on_press, on_release=on_release) as listener:
+                with sd.InputStream(
+                    callback=input_stream_callback,
+                    channels=max_channels,
+                    samplerate=sample_rate,
+                    device=core.input_device,
+                ):
+                    print(
+                        f"[green]Listening on device: {sd.query_devices(core.input_device)['name'] if isinstance(sd.query_devices(core.input_device), dict) and 'name' in sd.query_devices(core.input_device) else 'System Default'}[/green]"
+                    )
+                    listener.join()
+    except (TimeoutError, ValueError) as e:
         print(f"[red]Error: {e}[/red]")
         sys.exit(1)
     except KeyboardInterrupt:
         print("\n[yellow]Stopping...[/yellow]")
     finally:
+        if dictation is not None:
+            dictation.stop()
+        if pipeline is not None:
+            pipeline.stop(timeout=1)
+        if history_writer is not None:
+            history_writer.stop()
+            history_writer.join(timeout=5)
+        core.disconnect()
         core.stop_server()
+        tracer.close()
         print("[green]Cleanup completed. Exiting...[/green]")
 
 
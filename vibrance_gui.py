@@ -3,18 +3,23 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext
 from tkinter import messagebox
+import queue
 import threading
-import requests
 import time
-from rich.console import Console
-from rich.text import Text
 import sounddevice as sd
 import numpy as np
-from scipy.io import wavfile
-from pynput.keyboard import Key
-from app.keyboard import keyboard_controller
-from app.macros import MACROS
-from pyperclip import paste as clipboard_paste
+from pynput.keyboard import Key, Listener
+
+from app.core import VibranceCore
+from app.vad import ContinuousDictation, block_rms
+
+# How often the Tk main loop drains worker events and redraws the meter
+POLL_MS = 33
+# Input level meter range, in dBFS
+METER_FLOOR_DB = -60.0
+# Per-redraw decay of the meter's peak hold, in dB
+METER_FALLOFF_DB = 1.5
+
 
 class VibranceGUI:
     def __init__(self, root):
@@ -45,6 +50,11 @@ class VibranceGUI:
         self.typing_delay_entry.insert(0, "0.01")
         self.typing_delay_entry.grid(row=3, column=1, sticky="ew")
 
+        self.continuous_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            config_frame, text="Hands-free (continuous)", variable=self.continuous_var
+        ).grid(row=4, column=1, sticky="w")
+
         # Output Panel
         output_frame = ttk.LabelFrame(root, text="Transcription Output")
         output_frame.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
@@ -52,9 +62,20 @@ class VibranceGUI:
         self.output_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, height=15)
         self.output_text.grid(row=0, column=0, sticky="nsew")
 
+        # Status and input level
+        status_frame = ttk.Frame(root)
+        status_frame.grid(row=2, column=0, padx=10, sticky="ew")
+
+        self.status_label = ttk.Label(status_frame, text="Stopped")
+        self.status_label.grid(row=0, column=0, sticky="w")
+
+        self.level_meter = ttk.Progressbar(status_frame, maximum=-METER_FLOOR_DB, length=200)
+        self.level_meter.grid(row=0, column=1, sticky="e")
+        status_frame.grid_columnconfigure(0, weight=1)
+
         # Control Buttons
         control_frame = ttk.Frame(root)
-        control_frame.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
+        control_frame.grid(row=3, column=0, padx=10, pady=10, sticky="ew")
 
         self.start_button = ttk.Button(control_frame, text="Start", command=self.start_transcription)
         self.start_button.grid(row=0, column=0, padx=5)
@@ -66,49 +87,231 @@ class VibranceGUI:
         root.grid_rowconfigure(1, weight=1)
         root.grid_columnconfigure(0, weight=1)
 
-        self.server_process = None
-        self.recording = False
-        self.audio_data = []
-        self.sample_rate = 16000
+        self.core = None
+        self.pipeline = None
+        self.stream = None
+        self.listener = None
+        self.dictation = None
+        self.current_job = None
+        self.sample_rate = None
+        self.pressed_ctrl = False
+        self.pressed_shift = False
+        self.stop_event = threading.Event()
+
+        # Worker threads never touch widgets; they post (kind, payload)
+        # events here and the Tk main loop applies them in drain_events()
+        self.events = queue.Queue()
+
+        # Written by the audio callback, read by the main loop at display
+        # rate; a plain float, so no locking needed
+        self.level_db = METER_FLOOR_DB
+        self.level_updated = 0.0
+        self.meter_db = METER_FLOOR_DB
+
+        self.root.after(POLL_MS, self.drain_events)
+
+    def post(self, kind, payload=None):
+        self.events.put((kind, payload))
+
+    def log(self, text):
+        self.post("log", text)
+
+    def drain_events(self):
+        # Always reschedule, or one failing handler would freeze the window
+        try:
+            while True:
+                kind, payload = self.events.get_nowait()
+
+                if kind == "log":
+                    self.output_text.insert(tk.END, payload + "\n")
+                    self.output_text.see(tk.END)
+                elif kind == "status":
+                    self.status_label.config(text=payload)
+                elif kind == "ready":
+                    self.start_capture()
+                elif kind == "error":
+                    messagebox.showerror("Error", payload)
+                    self.stop_transcription()
+        except queue.Empty:
+            pass
+        finally:
+            self.update_meter()
+            self.root.after(POLL_MS, self.drain_events)
+
+    def update_meter(self):
+        # Peak hold with a steady fall-off, so short syllables stay visible
+        self.meter_db = max(self.level_db, self.meter_db - METER_FALLOFF_DB)
+        self.level_meter["value"] = self.meter_db - METER_FLOOR_DB
 
     def start_transcription(self):
+        try:
+            typing_delay = float(self.typing_delay_entry.get())
+            if typing_delay < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Typing delay must be a number of seconds")
+            return
+
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
 
-        # Start server and transcription in a separate thread
-        threading.Thread(target=self.run_transcription, daemon=True).start()
+        self.stop_event.clear()
+        self.core = VibranceCore(
+            server_host=f"{self.host_entry.get()}:{self.port_entry.get()}",
+            mode=self.mode_combobox.get(),
+            typing_delay=typing_delay,
+            start_progress=lambda label: self.post("status", label),
+            stop_progress=lambda task=None: self.post("status", "Ready"),
+        )
+
+        # Start server and wait for it in a separate thread
+        threading.Thread(target=self.run_server, daemon=True).start()
+
+    def run_server(self):
+        # Stop may clear self.core while we're still waiting
+        core = self.core
+
+        try:
+            self.post("status", "Starting server...")
+            self.log("Waiting for the server to be ready...")
+
+            core.start_server()
+            if not core.wait_for_server(stop_event=self.stop_event):
+                return
+
+            core.connect()
+            self.log(f"Transcriber is active ({core.transport.name} transport).")
+            self.post("ready")
+        except Exception as e:
+            self.post("error", str(e))
+
+    def start_capture(self):
+        """Runs on the main loop once the server is up."""
+        if self.stop_event.is_set():
+            return
+
+        try:
+            self.open_input()
+        except Exception as e:
+            # e.g. no input device, or PortAudio refusing the stream
+            self.post("error", f"Could not start audio capture: {e}")
+
+    def open_input(self):
+        self.pipeline = self.core.build_pipeline(on_stage=self.on_stage)
+
+        device_info = sd.query_devices(kind="input")
+        self.sample_rate = int(device_info["default_samplerate"])
+
+        if self.continuous_var.get():
+            self.dictation = ContinuousDictation(
+                self.core,
+                self.pipeline,
+                self.sample_rate,
+                on_state=lambda speaking: self.post(
+                    "status", "Hearing speech..." if speaking else "Listening"
+                ),
+            )
+            self.dictation.start()
+            self.post("status", "Listening")
+        else:
+            self.listener = Listener(on_press=self.on_press, on_release=self.on_release)
+            self.listener.start()
+            self.post("status", "Ready - hold right CTRL+SHIFT to dictate")
+
+        self.stream = sd.InputStream(
+            callback=self.input_stream_callback,
+            channels=1,
+            samplerate=self.sample_rate,
+        )
+        self.stream.start()
+
+    def on_stage(self, name, job):
+        if name == "transcribe":
+            self.log(f"[{job.id}] {job.transcript.strip()}")
+        elif name == "process" and job.generated:
+            self.log(f"[{job.id}] >>> {job.text.strip()}")
+
+    def on_press(self, key):
+        if key == Key.ctrl_r:
+            self.pressed_ctrl = True
+
+        if key == Key.shift_r:
+            self.pressed_shift = True
+
+        if self.pressed_ctrl and self.pressed_shift and self.current_job is None:
+            self.current_job = self.pipeline.new_job(self.sample_rate)
+            self.core.prepare_context(self.current_job)
+            self.post("status", "Recording...")
+
+    def on_release(self, key):
+        if key == Key.ctrl_r:
+            self.pressed_ctrl = False
+
+        if key == Key.shift_r:
+            self.pressed_shift = False
+
+        if self.current_job is not None and not (self.pressed_ctrl or self.pressed_shift):
+            job = self.current_job
+            self.current_job = None
+            self.post("status", "Ready")
+            self.pipeline.submit(job)
+
+    def input_stream_callback(self, indata, frames, time_info, status):
+        # Metering is throttled to the display rate; the RMS is a single
+        # vectorized pass over the block
+        now = time.monotonic()
+        if now - self.level_updated >= POLL_MS / 1000:
+            self.level_updated = now
+            self.level_db = max(
+                METER_FLOOR_DB, 20 * np.log10(max(block_rms(indata), 1e-10))
+            )
+
+        if self.dictation is not None:
+            self.dictation.feed(indata)
+            return
+
+        job = self.current_job
+        if job is not None:
+            job.audio_blocks.append(indata.copy())
 
     def stop_transcription(self):
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.recording = False
+        self.stop_event.set()
 
-        if self.server_process:
-            self.server_process.terminate()
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
 
-    def run_transcription(self):
-        try:
-            self.recording = True
-            self.output_text.insert(tk.END, "Waiting for the server to be ready...\n")
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
 
-            # Simulate server start and transcription process
-            time.sleep(2)  # Replace with actual server start logic
+        if self.dictation:
+            self.dictation.stop()
+            self.dictation = None
 
-            self.output_text.insert(tk.END, "Transcriber is active.\n")
-            self.output_text.see(tk.END)
+        self.current_job = None
+        self.level_db = METER_FLOOR_DB
 
-            # Simulate transcription process
-            while self.recording:
-                time.sleep(1)  # Replace with actual transcription logic
-                self.output_text.insert(tk.END, "[Transcription] Example output...\n")
-                self.output_text.see(tk.END)
+        core, pipeline = self.core, self.pipeline
+        self.core = self.pipeline = None
+
+        # Joining workers and the server can take a moment; keep it off the
+        # main loop
+        def shutdown():
+            if pipeline:
+                pipeline.stop(timeout=1)
+            if core:
+                core.disconnect()
+                core.stop_server()
+            self.post("status", "Stopped")
+
+        threading.Thread(target=shutdown, daemon=True).start()
 
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-        finally:
-            self.stop_transcription()
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = VibranceGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Search past dictations and replay their audio against the server"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import requests
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from app import history
+from app.transport import TRANSPORTS, negotiate_transport
+
+DEFAULT_HOST = "http://localhost"
+DEFAULT_PORT = 4242
+
+
+def parse_arguments():
+    """
+    Parses command-line arguments for the history tool.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Search and replay Vibrance dictation history")
+    parser.add_argument(
+        "--history-dir", type=str, default=history.HISTORY_DIR, help="History directory"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="List past entries, newest first")
+    search.add_argument(
+        "query",
+        nargs="?",
+        help="Words to look for in transcripts and output; entries must contain all of them",
+    )
+    search.add_argument("--limit", type=int, default=20, help="Maximum entries to show")
+
+    show = commands.add_parser("show", help="Show one entry in full")
+    show.add_argument("id", type=int, help="Entry ID")
+
+    replay = commands.add_parser("replay", help="Re-submit entries' audio to the server")
+    replay.add_argument("ids", type=int, nargs="+", help="Entry IDs")
+    replay.add_argument("--host", type=str, default=DEFAULT_HOST, help="Server host")
+    replay.add_argument("--port", type=int, default=DEFAULT_PORT, help="Server port")
+    replay.add_argument(
+        "--transport",
+        type=str,
+        choices=TRANSPORTS,
+        default="auto",
+        help="How audio is sent to the server",
+    )
+    replay.add_argument(
+        "--language", type=str, default="auto", help="Language code, or auto"
+    )
+
+    return parser.parse_args()
+
+
+def format_time(created: float) -> str:
+    return datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def print_entries(entries: list):
+    table = Table()
+    for column in ["id", "when", "mode", "lang", "secs", "transcript"]:
+        table.add_column(column, overflow="fold")
+
+    for entry in entries:
+        table.add_row(
+            str(entry["id"]),
+            format_time(entry["created"]),
+            entry["mode"] or "",
+            entry["language"] or "",
+            f"{entry['duration']:.1f}",
+            entry["transcript"],
+        )
+
+    Console().print(table)
+
+
+def print_entry(entry):
+    print(f"[yellow bold]#{entry['id']}[/yellow bold] {format_time(entry['created'])}")
+    print(f"Mode: {entry['mode']}  Model: {entry['model']}  Language: {entry['language']}")
+    print(f"Duration: {entry['duration']:.2f}s  Request: {entry['request_id']}")
+    print(f"Timings: {json.loads(entry['timings'] or '{}')}")
+    print(f"Audio: {entry['audio_path']}")
+    print(f'[white bold]Transcript:[/white bold] "{entry["transcript"]}"')
+    if entry["output"] and entry["output"] != entry["transcript"]:
+        print(f"[white bold]Output:[/white bold]\n{entry['output']}")
+
+
+def replay(db, args):
+    transport = negotiate_transport(
+        f"{args.host}:{args.port}",
+        args.transport,
+        headers={"X-Vibrance-Session": "history-replay", "X-Vibrance-Language": args.language},
+    )
+
+    try:
+        for entry_id in args.ids:
+            entry = history.get(db, entry_id)
+            if entry is None:
+                print(f"[red]No entry {entry_id}[/red]")
+                continue
+
+            audio = history.read_audio(os.path.join(args.history_dir, entry["audio_path"]))
+            result = transport.transcribe(audio)
+
+            print(f"[yellow bold]#{entry_id}[/yellow bold]")
+            print(f'  was: "{entry["transcript"]}"')
+            print(f'  now: "{result["text"]}"')
+    finally:
+        transport.close()
+
+
+def main():
+    args = parse_arguments()
+    db = history.connect(args.history_dir)
+
+    try:
+        if args.command == "search":
+            print_entries(history.search(db, args.query, args.limit))
+        elif args.command == "show":
+            entry = history.get(db, args.id)
+            if entry is None:
+                print(f"[red]No entry {args.id}[/red]")
+                sys.exit(1)
+            print_entry(entry)
+        elif args.command == "replay":
+            replay(db, args)
+    except requests.exceptions.RequestException as e:
+        print(f"[red]Error sending request to server:[/red] {e}")
+        sys.exit(1)
+    except sqlite3.Error as e:
+        print(f"[red]Error reading history:[/red] {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
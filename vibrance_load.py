@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Synthetic multi-client load generator for the transcription server"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+from rich import print
+from rich.console import Console
+from rich.table import Table
+from scipy.io import wavfile
+
+from app.audio import to_whisper_audio
+from app.history import read_audio
+from app.transport import TRANSPORTS, negotiate_transport
+
+DEFAULT_HOST = "http://localhost"
+DEFAULT_PORT = 4242
+
+DEMO_AUDIO = os.path.join(os.path.dirname(__file__), "docs", "demo.mp4")
+
+# Arrival processes for each simulated client:
+#   think   - closed loop; send, wait for the reply, then pause for an
+#             exponentially distributed think time (push-to-talk usage)
+#   poisson - open loop; requests are due at Poisson-distributed times
+#             regardless of how fast the server answers
+#   burst   - every client sends at the same moment, once per interval
+ARRIVALS = ["think", "poisson", "burst"]
+
+# Status codes that mean the server is shedding load rather than failing
+BACKPRESSURE_STATUS = [429, 503]
+
+
+def parse_arguments():
+    """
+    Parses command-line arguments for the load generator.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Replays recorded utterances against /transcribe from many simulated clients"
+    )
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Server host")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Server port")
+    parser.add_argument(
+        "--corpus",
+        type=str,
+        help="Directory of .wav utterances, or a history directory, to replay (defaults to the first seconds of the demo video)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=str,
+        default="1,2,4,8",
+        help="Comma separated numbers of simulated clients to step through",
+    )
+    parser.add_argument(
+        "--arrival", type=str, choices=ARRIVALS, default="think", help="Arrival process"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=2.0,
+        help="Mean pause between a reply and the next push-to-talk press, in seconds (think)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.5,
+        help="Requests per second per client (poisson)",
+    )
+    parser.add_argument(
+        "--burst-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between bursts (burst)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="Seconds to run each concurrency level"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="Per-request timeout in seconds"
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        choices=TRANSPORTS,
+        default="http",
+        help="How audio is sent to the server",
+    )
+    parser.add_argument(
+        "--start-server",
+        action="store_true",
+        help="Launch a local server for the run (see --cpu and --model)",
+    )
+    parser.add_argument("--cpu", action="store_true", help="Run the launched server on CPU")
+    parser.add_argument(
+        "--model", type=str, default="tiny", help="Model for the launched server"
+    )
+    parser.add_argument("--seed", type=int, help="Random seed for arrival times")
+    parser.add_argument("--json", type=str, help="Also write the results to this file")
+    return parser.parse_args()
+
+
+def load_corpus(path: str = None) -> list:
+    """Loads every utterance as 16 kHz mono float32 PCM."""
+    if path is None:
+        from faster_whisper import decode_audio
+
+        return [decode_audio(DEMO_AUDIO)[: 10 * 16000]]
+
+    # Clips kept by --history are already 16 kHz
+    corpus = [
+        read_audio(file_path)
+        for file_path in sorted(glob.glob(os.path.join(path, "**", "*.wav.gz"), recursive=True))
+    ]
+
+    for file_path in sorted(glob.glob(os.path.join(path, "*.wav"))):
+        sample_rate, audio = wavfile.read(file_path)
+
+        if np.issubdtype(audio.dtype, np.integer):
+            audio = audio / np.iinfo(audio.dtype).max
+
+        corpus.append(to_whisper_audio(audio, sample_rate))
+
+    if not corpus:
+        raise ValueError(f"No .wav or .wav.gz files found in {path}")
+
+    return corpus
+
+
+def start_server(port: int, cpu: bool, model: str) -> subprocess.Popen:
+    server_script = os.path.join(os.path.dirname(__file__), "app/server/server.py")
+    command = [sys.executable, server_script, f"--port={port}", f"--model={model}"]
+    if cpu:
+        command.append("--cpu")
+    return subprocess.Popen(command)
+
+
+def wait_for_server(server_host: str, timeout=600, interval=0.5):
+    start_time = time.time()
+
+    while time.time() - start_time < timeout:
+        try:
+            if requests.get(f"{server_host}/health", timeout=5).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(interval)
+
+    raise TimeoutError("Server failed to start within timeout")
+
+
+class Client(threading.Thread):
+    """One simulated dictator sending utterances until the level's deadline."""
+
+    def __init__(self, index: int, args, corpus: list, start: float, deadline: float, results: list):
+        super().__init__(name=f"load-client-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.corpus = corpus
+        self.start_at = start
+        self.deadline = deadline
+        self.results = results
+        self.random = random.Random(None if args.seed is None else args.seed + index)
+        self.transport = negotiate_transport(
+            f"{args.host}:{args.port}",
+            args.transport,
+            headers={"X-Vibrance-Session": f"load-{index}"},
+        )
+
+    def next_arrival(self, previous: float, finished: float) -> float:
+        if self.args.arrival == "think":
+            return finished + self.random.expovariate(1 / self.args.think_time)
+        if self.args.arrival == "poisson":
+            return previous + self.random.expovariate(self.args.rate)
+        return previous + self.args.burst_interval
+
+    def run(self):
+        if self.args.arrival == "poisson":
+            due = self.start_at + self.random.expovariate(self.args.rate)
+        else:
+            due = self.start_at
+
+        while due < self.deadline:
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            audio = self.corpus[self.random.randrange(len(self.corpus))]
+            outcome = "ok"
+            try:
+                self.transport.transcribe(audio, timeout=self.args.timeout)
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                outcome = "backpressure" if status in BACKPRESSURE_STATUS else "error"
+            except requests.exceptions.RequestException:
+                outcome = "error"
+
+            finished = time.time()
+
+            # Latency counts from when the request was due, not when it went
+            # out, so a client stuck behind a slow reply still sees the delay
+            self.results.append(
+                {
+                    "outcome": outcome,
+                    "latency": finished - due,
+                    "audio_seconds": audio.shape[0] / 16000,
+                }
+            )
+
+            due = self.next_arrival(due, finished)
+
+        self.transport.close()
+
+
+def run_level(args, corpus: list, concurrency: int) -> dict:
+    results = []
+    start = time.time() + 0.5
+    deadline = start + args.duration
+
+    clients = [
+        Client(index, args, corpus, start, deadline, results)
+        for index in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    elapsed = max(time.time() - start, 1e-9)
+    latencies = np.array([r["latency"] for r in results if r["outcome"] == "ok"])
+    total = len(results)
+
+    def percentile(q):
+        return float(np.percentile(latencies, q)) if latencies.size else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": int(latencies.size),
+        "errors": sum(r["outcome"] == "error" for r in results),
+        "backpressure": sum(r["outcome"] == "backpressure" for r in results),
+        "throughput": latencies.size / elapsed,
+        "audio_throughput": sum(r["audio_seconds"] for r in results if r["outcome"] == "ok") / elapsed,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p95": percentile(95),
+        "p99": percentile(99),
+    }
+
+
+def print_report(levels: list):
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    def rate(count, total):
+        return f"{(count / total if total else 0):.1%}"
+
+    table = Table(title="Transcription server load")
+    for column in ["clients", "requests", "req/s", "audio s/s", "p50", "p90", "p95", "p99", "errors", "backpressure"]:
+        table.add_column(column, justify="right")
+
+    for level in levels:
+        table.add_row(
+            str(level["concurrency"]),
+            str(level["requests"]),
+            f"{level['throughput']:.2f}",
+            f"{level['audio_throughput']:.1f}",
+            seconds(level["p50"]),
+            seconds(level["p90"]),
+            seconds(level["p95"]),
+            seconds(level["p99"]),
+            rate(level["errors"], level["requests"]),
+            rate(level["backpressure"], level["requests"]),
+        )
+
+    Console().print(table)
+
+
+def main():
+    args = parse_arguments()
+    server_host = f"{args.host}:{args.port}"
+    server_process = None
+
+    try:
+        corpus = load_corpus(args.corpus)
+        print(f"[yellow]Loaded {len(corpus)} utterance(s)[/yellow]")
+
+        if args.start_server:
+            server_process = start_server(args.port, args.cpu, args.model)
+
+        print("[yellow]Waiting for the server to be ready...[/yellow]")
+        wait_for_server(server_host)
+
+        levels = []
+        for concurrency in [int(n) for n in args.concurrency.split(",")]:
+            print(f"[green]Running {concurrency} client(s) for {args.duration:.0f}s ({args.arrival})...[/green]")
+            levels.append(run_level(args, corpus, concurrency))
+
+        print_report(levels)
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"arguments": vars(args), "levels": levels}, f, indent=2)
+    except (TimeoutError, ValueError) as e:
+        print(f"[red]Error: {e}[/red]")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[yellow]Stopping...[/yellow]")
+    finally:
+        if server_process:
+            server_process.terminate()
+            server_process.wait()
+
+
+if __name__ == "__main__":
+    main()